@@ -0,0 +1,124 @@
+"""
+Shared OAuth credential loading for the Gmail, Drive and Sheets services.
+"""
+
+import os
+import json
+import pickle
+import logging
+from typing import Dict, Iterable, Optional, Tuple
+
+from google.oauth2.credentials import Credentials
+
+logger = logging.getLogger(__name__)
+
+# Credentials already loaded in this process, keyed by token file
+_CREDS_CACHE: Dict[str, Credentials] = {}
+
+
+def write_token(creds: Credentials, token_file: str):
+    """
+    Write credentials to token_file as JSON, replacing the file atomically.
+    
+    A crash mid-write leaves the old token intact instead of a torn file
+    that every service sharing it would fail to load.
+    
+    Args:
+        creds: Credentials to save
+        token_file: Path to the token file
+    """
+    tmp_file = token_file + '.tmp'
+    with open(tmp_file, 'w') as token:
+        token.write(creds.to_json())
+        token.flush()
+        os.fsync(token.fileno())
+    os.replace(tmp_file, token_file)
+
+
+def load_token(token_file: str) -> Tuple[Optional[Credentials], bool]:
+    """
+    Load credentials from a token file, JSON or a legacy pickled token.
+    
+    The scopes stored in the token are kept, so has_scopes() can check them.
+    
+    Args:
+        token_file: Path to the token file
+    
+    Returns:
+        (credentials, is_legacy_pickle), or (None, False) if the file doesn't exist
+    """
+    try:
+        token = open(token_file, 'rb')
+    except FileNotFoundError:
+        return None, False
+    with token:
+        token_data = token.read()
+    try:
+        info = json.loads(token_data)
+    except ValueError:
+        # Tokens written by older versions of manual_auth.py are pickled
+        return pickle.loads(token_data), True
+    return Credentials.from_authorized_user_info(info), False
+
+
+def has_scopes(creds: Credentials, scopes: Iterable[str]) -> bool:
+    """Check that creds were granted every scope in scopes."""
+    return set(scopes) <= set(creds.scopes or ())
+
+
+def get_creds(token_file: str, scopes: Optional[Iterable[str]] = None) -> Credentials:
+    """
+    Load credentials from a token file, refreshing and saving them if expired.
+    
+    The result is kept for the life of the process, so services sharing a
+    token file read it from disk and refresh it at most once between them.
+    
+    Args:
+        token_file: Path to the token file written by manual_auth.py
+        scopes: Scopes the caller needs; a token missing any of them is rejected
+    
+    Returns:
+        Valid credentials
+    """
+    creds = _CREDS_CACHE.get(token_file)
+    if creds is None:
+        creds, _ = load_token(token_file)
+    
+    # e.g. a Gmail-only token from before Drive and Sheets shared it
+    if creds and scopes and not has_scopes(creds, scopes):
+        missing = sorted(set(scopes) - set(creds.scopes or ()))
+        logger.error(f"Token {token_file} is missing scopes: {', '.join(missing)}")
+        logger.error("Please re-run 'python manual_auth.py' to grant them.")
+        raise Exception(f"Token {token_file} is missing scopes. Please re-run 'python manual_auth.py' to re-authenticate.")
+    
+    # If credentials are invalid or don't exist, get new ones
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            # Only a refresh needs the HTTP transport
+            from google.auth.transport.requests import Request
+            
+            try:
+                creds.refresh(Request())
+            except Exception as e:
+                error_msg = str(e)
+                if 'invalid_grant' in error_msg.lower():
+                    logger.error(f"Token refresh failed: {error_msg}")
+                    logger.error("The refresh token has expired or been revoked.")
+                    logger.error("Please run 'python manual_auth.py' to re-authenticate.")
+                    # Delete the invalid token file
+                    _CREDS_CACHE.pop(token_file, None)
+                    if os.path.exists(token_file):
+                        os.remove(token_file)
+                        logger.info(f"Removed invalid token file: {token_file}")
+                    raise Exception(f"Authentication failed. Please run 'python manual_auth.py' to re-authenticate. Error: {error_msg}")
+                else:
+                    raise
+        else:
+            logger.error("No valid credentials found. Please run 'python manual_auth.py' to authenticate.")
+            raise Exception("No valid credentials found. Please run 'python manual_auth.py' to authenticate.")
+        
+        # Save credentials for future use
+        write_token(creds, token_file)
+    
+    _CREDS_CACHE[token_file] = creds
+    return creds
@@ -5,8 +5,8 @@ CSV processing module for transforming lead data.
 import csv
 import json
 import logging
-from io import StringIO, BytesIO
-from typing import List, Dict, Any
+from io import StringIO, BytesIO, TextIOWrapper
+from typing import List, Dict, Any, BinaryIO, Iterable, Iterator
 from urllib.parse import unquote
 
 logger = logging.getLogger(__name__)
@@ -29,43 +29,58 @@ class CSVProcessor:
             List of processed row dictionaries
         """
         try:
-            # Decode CSV data
-            csv_text = csv_data.decode('utf-8', errors='ignore')
+            # Parse straight from the attachment bytes rather than decoding and
+            # splitting a full copy of the text first
+            processed_rows = list(self.stream_csv_attachment(BytesIO(csv_data)))
             
-            # Clean the CSV data (similar to Power Automate replace operations)
-            # Remove carriage returns and clean quotes
-            csv_text = csv_text.replace('\r', '')
-            csv_text = csv_text.replace('""', '"')
-            
-            # Split into lines and skip header (take skip 1)
-            lines = csv_text.split('\n')
-            if len(lines) > 1:
-                lines = lines[1:]  # Skip header
-            
-            # Process ALL rows (no limit)
-            
-            # Filter out empty lines
-            lines = [line.strip() for line in lines if line.strip()]
-            
-            logger.info(f"Processing {len(lines)} CSV rows")
+            logger.info(f"Successfully processed {len(processed_rows)} rows")
+            return processed_rows
             
-            processed_rows = []
+        except Exception as e:
+            logger.error(f"Error processing CSV: {e}")
+            return []
+    
+    def stream_csv_attachment(self, csv_file: BinaryIO) -> Iterator[Dict[str, str]]:
+        """
+        Process CSV attachment data one row at a time.
+        
+        Applies the same cleaning as process_csv_attachment, but reads the
+        file lazily so memory use does not grow with the number of rows.
+        
+        Args:
+            csv_file: Binary file-like object with the raw CSV data
+        
+        Yields:
+            Processed row dictionaries
+        """
+        # Split on '\n' only; a stray '\r' inside a field is dropped below, not a line break
+        csv_text = TextIOWrapper(csv_file, encoding='utf-8', errors='ignore', newline='\n')
+        processed_count = 0
+        try:
+            # Skip header, unless there is no line break at all: like the
+            # original split('\n'), a lone line is treated as data
+            first_line = next(csv_text, '')
+            lines = csv_text if first_line.endswith('\n') else [first_line]
             
             for line in lines:
+                line = line.replace('\r', '').replace('""', '"').strip()
+                if not line:
+                    continue
+                
                 try:
                     row_data = self._process_csv_row(line)
-                    if row_data:
-                        processed_rows.append(row_data)
                 except Exception as e:
                     logger.warning(f"Error processing row: {line[:100]}... Error: {e}")
                     continue
-            
-            logger.info(f"Successfully processed {len(processed_rows)} rows")
-            return processed_rows
-            
-        except Exception as e:
-            logger.error(f"Error processing CSV: {e}")
-            return []
+                
+                if row_data:
+                    processed_count += 1
+                    yield row_data
+        finally:
+            # Leave the caller's file open
+            csv_text.detach()
+        
+        logger.info(f"Successfully streamed {processed_count} rows")
     
     def _process_csv_row(self, row_text: str) -> Dict[str, str]:
         """
@@ -144,6 +159,38 @@ class CSVProcessor:
             logger.error(f"Error creating output CSV: {e}")
             return b''
     
+    def create_output_csv_stream(self, 
+                                 processed_rows: Iterable[Dict[str, str]], 
+                                 output: BinaryIO) -> int:
+        """
+        Write processed rows to a binary file-like object as they arrive.
+        
+        Args:
+            processed_rows: Iterable of processed row dictionaries
+            output: Binary file-like object to write the CSV to
+        
+        Returns:
+            Number of rows written
+        """
+        output_text = TextIOWrapper(output, encoding='utf-8', newline='')
+        row_count = 0
+        try:
+            writer = None
+            for row in processed_rows:
+                if writer is None:
+                    # Get field names from first row
+                    writer = csv.DictWriter(output_text, fieldnames=list(row.keys()))
+                    writer.writeheader()
+                writer.writerow(row)
+                row_count += 1
+            output_text.flush()
+        finally:
+            # Leave the caller's file open
+            output_text.detach()
+        
+        logger.info(f"Streamed output CSV with {row_count} rows")
+        return row_count
+    
     def generate_temp_filename(self, original_filename: str) -> str:
         """
         Generate temporary filename similar to Power Automate flow.
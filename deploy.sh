@@ -147,7 +147,7 @@ EOF
     
     # Check for required credential files
     local missing_files=()
-    for file in "credentials.json" "token.json" "drive_token.json" "sheets_token.json"; do
+    for file in "credentials.json" "token.json"; do
         if [[ ! -f "$APP_DIR/$file" ]]; then
             missing_files+=("$file")
         fi
@@ -22,6 +22,7 @@ from dotenv import load_dotenv
 from gmail_service import GmailService
 from google_drive_service import GoogleDriveService
 from google_sheets_service import GoogleSheetsService
+from google_discovery import GoogleClientPool
 from csv_processor import CSVProcessor
 
 # Load environment variables
@@ -86,14 +87,19 @@ class EmailProcessor:
                 self.gmail_token_file
             )
             
+            # Drive and Sheets share the Gmail token (see manual_auth.py) and one connection
+            self.client_pool = GoogleClientPool(self.gmail_service.creds)
+            
             self.drive_service = GoogleDriveService(
                 self.drive_credentials_file,
-                'drive_token.json'
+                self.gmail_token_file,
+                http=self.client_pool.http
             )
             
             self.sheets_service = GoogleSheetsService(
                 self.sheets_credentials_file,
-                'sheets_token.json'
+                self.gmail_token_file,
+                http=self.client_pool.http
             )
             
             self.csv_processor = CSVProcessor(self.max_rows_to_process)
@@ -154,12 +160,13 @@ class EmailProcessor:
             if find_recent:
                 # Only process the most recent email (first result)
                 self.logger.info(f"Found {len(message_ids)} matching emails, processing most recent one")
-                self.process_single_email(message_ids[0])
+                message_ids = message_ids[:1]
             else:
                 self.logger.info(f"Found {len(message_ids)} emails to process")
-                # Process each email
-                for message_id in message_ids:
-                    self.process_single_email(message_id)
+            
+            # Fetch all messages in batched requests, then process each email
+            for message in self.gmail_service.get_messages_with_attachments_batch(message_ids):
+                self.process_message(message)
             
             self.logger.info("Email processing cycle completed")
             
@@ -182,13 +189,26 @@ class EmailProcessor:
                 self.logger.warning(f"Could not retrieve message: {message_id}")
                 return
             
+            self.process_message(message)
+            
+        except Exception as e:
+            self.logger.error(f"Error processing email {message_id}: {e}")
+    
+    def process_message(self, message: Dict):
+        """
+        Process an already retrieved email for MatrixCare Looker Dash automation.
+        
+        Args:
+            message: Message dictionary with attachments
+        """
+        try:
             self.logger.info(f"Email from: {message['from']}, Subject: {message['subject']}")
             
             # Process the email content for MatrixCare Looker Dash
             self.process_matrixcare_email(message)
             
         except Exception as e:
-            self.logger.error(f"Error processing email {message_id}: {e}")
+            self.logger.error(f"Error processing email {message.get('id')}: {e}")
     
     def process_matrixcare_email(self, message: Dict):
         """
@@ -370,9 +390,9 @@ class EmailProcessor:
             
             self.logger.info(f"Found {len(message_ids)} emails to process")
             
-            # Process each email
-            for message_id in message_ids:
-                self.process_single_email(message_id)
+            # Fetch all messages in batched requests, then process each email
+            for message in self.gmail_service.get_messages_with_attachments_batch(message_ids):
+                self.process_message(message)
             
             self.logger.info("Manual email check completed")
             
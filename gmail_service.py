@@ -2,70 +2,46 @@
 Gmail API service for monitoring and processing emails with attachments.
 """
 
-import os
 import base64
-import pickle
+import asyncio
 import logging
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import Any, List, Dict, Optional
 from email.mime.text import MIMEText
 
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from google_auth_httplib2 import AuthorizedHttp
+from _auth import get_creds
+from google_discovery import TRANSPORT_ERRORS, build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import build_http
 
 # Gmail API scopes
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
 
+# Most calls the Gmail batch endpoint accepts in one request
+BATCH_SIZE = 100
+
 logger = logging.getLogger(__name__)
 
 
 class GmailService:
     """Service class for Gmail API operations."""
     
-    def __init__(self, credentials_file: str, token_file: str):
+    def __init__(self, credentials_file: str, token_file: str, http=None):
         self.credentials_file = credentials_file
         self.token_file = token_file
+        self.http = http  # Shared authorized connection, e.g. GoogleClientPool.http
         self.service = None
+        self.creds = None
         self._authenticate()
     
     def _authenticate(self):
         """Authenticate with Gmail API."""
-        creds = None
-        
-        # Load existing token
-        if os.path.exists(self.token_file):
-            with open(self.token_file, 'rb') as token:
-                creds = pickle.load(token)
-        
-        # If credentials are invalid or don't exist, get new ones
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                try:
-                    creds.refresh(Request())
-                except Exception as e:
-                    error_msg = str(e)
-                    if 'invalid_grant' in error_msg.lower():
-                        logger.error(f"Token refresh failed: {error_msg}")
-                        logger.error("The refresh token has expired or been revoked.")
-                        logger.error("Please run 'python manual_auth.py' to re-authenticate.")
-                        # Delete the invalid token file
-                        if os.path.exists(self.token_file):
-                            os.remove(self.token_file)
-                            logger.info(f"Removed invalid token file: {self.token_file}")
-                        raise Exception(f"Authentication failed. Please run 'python manual_auth.py' to re-authenticate. Error: {error_msg}")
-                    else:
-                        raise
-            else:
-                logger.error("No valid credentials found. Please run 'python manual_auth.py' to authenticate.")
-                raise Exception("No valid credentials found. Please run 'python manual_auth.py' to authenticate.")
-            
-            # Save credentials for future use
-            with open(self.token_file, 'wb') as token:
-                pickle.dump(creds, token)
+        # Shared with the other services using the same token file
+        creds = get_creds(self.token_file, SCOPES)
         
-        self.service = build('gmail', 'v1', credentials=creds)
+        self.creds = creds
+        self.service = build('gmail', 'v1', credentials=creds, http=self.http)
         logger.info("Gmail service authenticated successfully")
     
     def search_emails(self, 
@@ -145,52 +121,173 @@ class GmailService:
             ).execute()
             
             attachments = []
-            
-            def extract_attachments(parts):
-                """Recursively extract attachments from message parts."""
-                if not parts:
-                    return
+            for part in self._attachment_parts(message.get('payload', {}).get('parts')):
+                attachment = self.service.users().messages().attachments().get(
+                    userId='me',
+                    messageId=message_id,
+                    id=part['body']['attachmentId']
+                ).execute()
                 
-                for part in parts:
-                    if part.get('filename'):
-                        attachment_id = part['body'].get('attachmentId')
-                        if attachment_id:
-                            attachment = self.service.users().messages().attachments().get(
-                                userId='me',
-                                messageId=message_id,
-                                id=attachment_id
-                            ).execute()
-                            
-                            attachments.append({
-                                'filename': part['filename'],
-                                'mimeType': part['mimeType'],
-                                'data': attachment['data']
-                            })
-                    
-                    # Check nested parts
-                    if 'parts' in part:
-                        extract_attachments(part['parts'])
-            
-            # Extract attachments from message payload
-            payload = message.get('payload', {})
-            if 'parts' in payload:
-                extract_attachments(payload['parts'])
-            
-            return {
-                'id': message_id,
-                'subject': next((h['value'] for h in message['payload']['headers'] 
-                               if h['name'] == 'Subject'), ''),
-                'from': next((h['value'] for h in message['payload']['headers'] 
-                             if h['name'] == 'From'), ''),
-                'date': next((h['value'] for h in message['payload']['headers'] 
-                             if h['name'] == 'Date'), ''),
-                'attachments': attachments
-            }
+                attachments.append({
+                    'filename': part['filename'],
+                    'mimeType': part['mimeType'],
+                    'data': attachment['data']
+                })
+            
+            return self._message_details(message_id, message, attachments)
             
         except HttpError as error:
             logger.error(f"Error getting message {message_id}: {error}")
             return None
     
+    def get_messages_with_attachments_batch(self, message_ids: List[str], format: str = 'full') -> List[Dict]:
+        """
+        Get details including attachments for several messages at once.
+        
+        Messages are fetched through the Gmail batch endpoint, then all of
+        their attachments in a second batch, instead of one request each.
+        
+        Args:
+            message_ids: Gmail message IDs
+            format: Gmail message format to request
+        
+        Returns:
+            List of message dictionaries in the order of message_ids.
+            Messages that could not be retrieved, or whose attachments
+            could not be, are left out.
+        """
+        messages = self._execute_batch({
+            message_id: self.service.users().messages().get(
+                userId='me',
+                id=message_id,
+                format=format
+            )
+            for message_id in message_ids
+        })
+        
+        # Attachment parts per message, keyed by their batch request id
+        attachment_parts = {
+            message_id: {
+                f'{message_id}:{index}': part
+                for index, part in enumerate(self._attachment_parts(message.get('payload', {}).get('parts')))
+            }
+            for message_id, message in messages.items()
+        }
+        attachment_data = self._execute_batch({
+            request_id: self.service.users().messages().attachments().get(
+                userId='me',
+                messageId=message_id,
+                id=part['body']['attachmentId']
+            )
+            for message_id, parts in attachment_parts.items()
+            for request_id, part in parts.items()
+        })
+        
+        results = []
+        for message_id in dict.fromkeys(message_ids):
+            if message_id not in messages:
+                logger.error(f"Error getting message {message_id}")
+                continue
+            
+            if any(request_id not in attachment_data for request_id in attachment_parts[message_id]):
+                logger.error(f"Error getting attachments for message {message_id}")
+                continue
+            
+            attachments = [
+                {
+                    'filename': part['filename'],
+                    'mimeType': part['mimeType'],
+                    'data': attachment_data[request_id]['data']
+                }
+                for request_id, part in attachment_parts[message_id].items()
+            ]
+            results.append(self._message_details(message_id, messages[message_id], attachments))
+        
+        logger.info(f"Retrieved {len(results)} of {len(message_ids)} messages")
+        return results
+    
+    def _execute_batch(self, requests: Dict[str, Any]) -> Dict[str, Dict]:
+        """
+        Execute API requests through the batch endpoint, BATCH_SIZE at a time.
+        
+        Falls back to running a chunk's requests concurrently if the batch
+        endpoint itself fails or the connection drops.
+        
+        Args:
+            requests: API requests keyed by a unique request id
+        
+        Returns:
+            Responses keyed by request id. Failed requests are left out.
+        """
+        responses = {}
+        
+        def callback(request_id, response, exception):
+            if exception is not None:
+                logger.error(f"Error in batch request {request_id}: {exception}")
+            else:
+                responses[request_id] = response
+        
+        items = list(requests.items())
+        for start in range(0, len(items), BATCH_SIZE):
+            chunk = items[start:start + BATCH_SIZE]
+            batch = self.service.new_batch_http_request(callback=callback)
+            for request_id, request in chunk:
+                batch.add(request, request_id=request_id)
+            
+            try:
+                batch.execute()
+            except (HttpError, *TRANSPORT_ERRORS) as error:
+                logger.warning(f"Batch request failed, falling back to concurrent requests: {error}")
+                responses.update(asyncio.run(self._execute_concurrently(chunk)))
+        
+        return responses
+    
+    async def _execute_concurrently(self, requests: List[tuple]) -> Dict[str, Dict]:
+        """
+        Execute API requests concurrently, one thread each.
+        
+        Args:
+            requests: (request id, API request) pairs
+        
+        Returns:
+            Responses keyed by request id. Failed requests are left out.
+        """
+        async def execute(request_id, request):
+            # httplib2 connections are not thread-safe, so each request gets its own
+            http = AuthorizedHttp(self.creds, http=build_http())
+            try:
+                return request_id, await asyncio.to_thread(request.execute, http=http)
+            except (HttpError, *TRANSPORT_ERRORS) as error:
+                logger.error(f"Error in request {request_id}: {error}")
+                return request_id, None
+        
+        results = await asyncio.gather(*(execute(request_id, request) for request_id, request in requests))
+        return {request_id: response for request_id, response in results if response is not None}
+    
+    def _attachment_parts(self, parts: Optional[List[Dict]]):
+        """Recursively yield message parts that carry an attachment."""
+        if not parts:
+            return
+        
+        for part in parts:
+            if part.get('filename') and part['body'].get('attachmentId'):
+                yield part
+            
+            # Check nested parts
+            if 'parts' in part:
+                yield from self._attachment_parts(part['parts'])
+    
+    def _message_details(self, message_id: str, message: Dict, attachments: List[Dict]) -> Dict:
+        """Build the message dictionary returned to callers."""
+        headers = message['payload']['headers']
+        return {
+            'id': message_id,
+            'subject': next((h['value'] for h in headers if h['name'] == 'Subject'), ''),
+            'from': next((h['value'] for h in headers if h['name'] == 'From'), ''),
+            'date': next((h['value'] for h in headers if h['name'] == 'Date'), ''),
+            'attachments': attachments
+        }
+    
     def download_attachment(self, attachment_data: str) -> bytes:
         """
         Decode and return attachment data.
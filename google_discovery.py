@@ -0,0 +1,86 @@
+"""
+Shared helpers for building Google API service objects: cached discovery
+documents and a shared, authorized HTTP transport.
+"""
+
+import json
+import logging
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient import discovery
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import build_http
+
+logger = logging.getLogger(__name__)
+
+# Network failures (timeouts, dropped connections) raised instead of an HttpError
+TRANSPORT_ERRORS = (httplib2.HttpLib2Error, OSError)
+
+
+@lru_cache(maxsize=None)
+def _discovery_document(service_name: str, version: str) -> Optional[Dict[str, Any]]:
+    """
+    Load and parse a discovery document bundled with google-api-python-client.
+    
+    The parsed document is kept for the life of the process, so building the
+    same API again skips the file read and JSON parse.
+    
+    Args:
+        service_name: API name, e.g. 'sheets'
+        version: API version, e.g. 'v4'
+    
+    Returns:
+        Parsed discovery document, or None if it isn't bundled
+    """
+    document = get_static_doc(service_name, version)
+    if document is None:
+        return None
+    return json.loads(document)
+
+
+class GoogleClientPool:
+    """One authorized HTTP transport shared by the Drive and Sheets services."""
+    
+    def __init__(self, creds):
+        """
+        Args:
+            creds: Credentials to authorize every request on the connection with
+        """
+        self.creds = creds
+        # httplib2 keeps one connection per host, so repeated calls to the same API reuse it.
+        # build_http() keeps googleapiclient's socket timeout and leaves 308 responses to
+        # resumable uploads instead of following them as redirects.
+        # httplib2 is not thread-safe, so share this only between services used on one thread.
+        self.http = AuthorizedHttp(creds, http=build_http())
+
+
+def build(service_name: str, version: str, credentials=None, http=None, **kwargs):
+    """
+    Drop-in replacement for googleapiclient.discovery.build.
+    
+    Args:
+        service_name: API name, e.g. 'sheets'
+        version: API version, e.g. 'v4'
+        credentials: Credentials to authorize requests with
+        http: Authorized HTTP object to send requests on, e.g. GoogleClientPool.http.
+              It carries its own credentials, so credentials is ignored when given.
+        **kwargs: Passed through to googleapiclient
+    
+    Returns:
+        Google API service object
+    """
+    if http is not None:
+        kwargs['http'] = http
+    else:
+        kwargs['credentials'] = credentials
+    
+    document = _discovery_document(service_name, version)
+    if document is None:
+        # Not bundled with this client library; let googleapiclient fetch it
+        logger.info(f"No bundled discovery document for {service_name} {version}")
+        return discovery.build(service_name, version, **kwargs)
+    
+    return discovery.build_from_document(document, **kwargs)
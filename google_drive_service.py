@@ -2,16 +2,13 @@
 Google Drive API service for file upload and management.
 """
 
-import os
-import pickle
 import logging
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Optional
 from io import BytesIO
 
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from _auth import get_creds
+from google_discovery import TRANSPORT_ERRORS, build
 from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseUpload
 
@@ -21,54 +18,28 @@ SCOPES = [
     'https://www.googleapis.com/auth/spreadsheets'
 ]
 
+# Most calls the Drive batch endpoint accepts in one request
+BATCH_SIZE = 100
+
 logger = logging.getLogger(__name__)
 
 
 class GoogleDriveService:
     """Service class for Google Drive API operations."""
     
-    def __init__(self, credentials_file: str, token_file: str = 'drive_token.json'):
+    def __init__(self, credentials_file: str, token_file: str = 'token.json', http=None):
         self.credentials_file = credentials_file
         self.token_file = token_file
+        self.http = http  # Shared authorized connection, e.g. GoogleClientPool.http
         self.service = None
         self._authenticate()
     
     def _authenticate(self):
         """Authenticate with Google Drive API."""
-        creds = None
-        
-        # Load existing token
-        if os.path.exists(self.token_file):
-            with open(self.token_file, 'rb') as token:
-                creds = pickle.load(token)
+        # Shared with the other services using the same token file
+        creds = get_creds(self.token_file, SCOPES)
         
-        # If credentials are invalid or don't exist, get new ones
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                try:
-                    creds.refresh(Request())
-                except Exception as e:
-                    error_msg = str(e)
-                    if 'invalid_grant' in error_msg.lower():
-                        logger.error(f"Token refresh failed: {error_msg}")
-                        logger.error("The refresh token has expired or been revoked.")
-                        logger.error("Please run 'python manual_auth.py' to re-authenticate.")
-                        # Delete the invalid token file
-                        if os.path.exists(self.token_file):
-                            os.remove(self.token_file)
-                            logger.info(f"Removed invalid token file: {self.token_file}")
-                        raise Exception(f"Authentication failed. Please run 'python manual_auth.py' to re-authenticate. Error: {error_msg}")
-                    else:
-                        raise
-            else:
-                logger.error("No valid credentials found. Please run 'python manual_auth.py' to authenticate.")
-                raise Exception("No valid credentials found. Please run 'python manual_auth.py' to authenticate.")
-            
-            # Save credentials for future use
-            with open(self.token_file, 'wb') as token:
-                pickle.dump(creds, token)
-        
-        self.service = build('drive', 'v3', credentials=creds)
+        self.service = build('drive', 'v3', credentials=creds, http=self.http)
         logger.info("Google Drive service authenticated successfully")
     
     def upload_file(self, 
@@ -138,6 +109,97 @@ class GoogleDriveService:
             logger.error(f"Error downloading file {file_id}: {error}")
             return None
     
+    def share_batch(self, file_id: str, emails: List[str], role: str = 'reader') -> Dict[str, str]:
+        """
+        Share a file with several users in batched requests.
+        
+        Drive doesn't guarantee that concurrent permission changes on one file
+        all apply, so the grants are confirmed with a single list call and any
+        missing ones are retried one at a time. If the list call fails, nothing
+        is retried, since a retry would email users who already have access.
+        
+        Args:
+            file_id: Google Drive file ID
+            emails: Email addresses to share the file with
+            role: Permission role, e.g. 'reader' or 'writer'
+        
+        Returns:
+            Permission IDs keyed by email address, for the users the file is shared with
+        """
+        emails = list(dict.fromkeys(emails))
+        created = {}  # Permission IDs the batch reported, keyed by lowercased email
+        
+        def create_permission(email):
+            return self.service.permissions().create(
+                fileId=file_id,
+                body={'type': 'user', 'role': role, 'emailAddress': email},
+                fields='id'
+            )
+        
+        def callback(request_id, response, exception):
+            if exception is not None:
+                logger.warning(f"Batched share of {file_id} with {request_id} failed: {exception}")
+            else:
+                created[request_id.lower()] = response['id']
+        
+        try:
+            for start in range(0, len(emails), BATCH_SIZE):
+                batch = self.service.new_batch_http_request(callback=callback)
+                for email in emails[start:start + BATCH_SIZE]:
+                    batch.add(create_permission(email), request_id=email)
+                batch.execute()
+        except (HttpError, *TRANSPORT_ERRORS) as error:
+            logger.warning(f"Batch sharing of {file_id} failed, sharing one at a time: {error}")
+        
+        granted = self._list_permissions(file_id)
+        if granted is None:
+            # Can't tell which grants were dropped, so report what the batch returned
+            granted = created
+        else:
+            for email in emails:
+                if email.lower() in granted:
+                    continue
+                try:
+                    granted[email.lower()] = create_permission(email).execute()['id']
+                except (HttpError, *TRANSPORT_ERRORS) as error:
+                    logger.error(f"Error sharing file {file_id} with {email}: {error}")
+        
+        shared = {email: granted[email.lower()] for email in emails if email.lower() in granted}
+        logger.info(f"Shared file {file_id} with {len(shared)} of {len(emails)} users as {role}")
+        return shared
+    
+    def _list_permissions(self, file_id: str) -> Optional[Dict[str, str]]:
+        """
+        List a file's user permissions.
+        
+        Args:
+            file_id: Google Drive file ID
+        
+        Returns:
+            Permission IDs keyed by lowercased email address, or None if failed
+        """
+        permissions = {}
+        page_token = None
+        try:
+            while True:
+                result = self.service.permissions().list(
+                    fileId=file_id,
+                    fields='nextPageToken, permissions(id, emailAddress)',
+                    pageSize=100,
+                    pageToken=page_token
+                ).execute()
+                
+                for permission in result.get('permissions', []):
+                    if permission.get('emailAddress'):
+                        permissions[permission['emailAddress'].lower()] = permission['id']
+                
+                page_token = result.get('nextPageToken')
+                if not page_token:
+                    return permissions
+        except (HttpError, *TRANSPORT_ERRORS) as error:
+            logger.error(f"Error listing permissions for {file_id}: {error}")
+            return None
+    
     def create_timestamped_filename(self, prefix: str, extension: str = 'csv') -> str:
         """
         Create a timestamped filename.
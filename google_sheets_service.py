@@ -2,15 +2,15 @@
 Google Sheets API service for creating and managing spreadsheets.
 """
 
-import os
-import pickle
+import copy
+import time
 import logging
+import threading
 from datetime import datetime
 from typing import List, Dict, Optional, Any
 import gspread
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from _auth import get_creds
+from google_discovery import build
 from googleapiclient.errors import HttpError
 
 # Google Sheets API scopes
@@ -19,60 +19,154 @@ SCOPES = [
     'https://www.googleapis.com/auth/drive.file'
 ]
 
+# Sheets allows 60 requests per minute per user
+REQUESTS_PER_MINUTE = 60
+
+# Longest Retry-After, in seconds, honoured before retrying a request
+MAX_RETRY_AFTER = 60
+
+# Cells written per values.append; larger payloads are split across requests
+MAX_CELLS = 40000
+
+# Columns produced by CSVProcessor for MatrixCare lead data
+LEAD_HEADERS = ('LeadCreationDate', 'InquiryDate', 'CommunityName', 'Classification',
+                'TotalLeads', 'SubSourceName', 'SourceName', 'LeadID')
+
 logger = logging.getLogger(__name__)
 
 
+class TokenBucket:
+    """Thread-safe token bucket that spaces requests out to stay under a rate quota."""
+    
+    def __init__(self, rate: float, capacity: float, penalty_seconds: float = 60.0):
+        """
+        Args:
+            rate: Tokens added per second
+            capacity: Most tokens the bucket holds, i.e. the largest burst
+            penalty_seconds: How long a throttle() halves the rate for
+        """
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.penalty_seconds = penalty_seconds
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._penalty_until = None
+        self._lock = threading.Lock()
+    
+    def _refill(self, now: float):
+        """Add the tokens earned since the last update. Caller holds the lock."""
+        if self._penalty_until is not None and now >= self._penalty_until:
+            # Penalty window is over; go back to the full rate
+            self.rate = self.base_rate
+            self._penalty_until = None
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    def acquire(self):
+        """Take one token, sleeping until one is available."""
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+    
+    def throttle(self):
+        """Empty the bucket and halve the refill rate for the penalty window after a rate limit response."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # The quota is spent, so no burst until tokens are earned again
+            self._tokens = 0
+            if self._penalty_until is None:
+                # Halve once per window; more 429s in the same window only extend it
+                self.rate = self.base_rate / 2
+            self._penalty_until = now + self.penalty_seconds
+
+
 class GoogleSheetsService:
     """Service class for Google Sheets API operations."""
     
-    def __init__(self, credentials_file: str, token_file: str = 'sheets_token.json'):
+    # The quota is per user, so every instance in the process draws from one bucket
+    _bucket = TokenBucket(rate=REQUESTS_PER_MINUTE / 60.0, capacity=REQUESTS_PER_MINUTE)
+    
+    def __init__(self, credentials_file: str, token_file: str = 'token.json', http=None):
         self.credentials_file = credentials_file
         self.token_file = token_file
+        self.http = http  # Shared authorized connection, e.g. GoogleClientPool.http
         self.service = None
         self.gc = None  # gspread client
         self._authenticate()
     
     def _authenticate(self):
         """Authenticate with Google Sheets API."""
-        creds = None
-        
-        # Load existing token
-        if os.path.exists(self.token_file):
-            with open(self.token_file, 'rb') as token:
-                creds = pickle.load(token)
-        
-        # If credentials are invalid or don't exist, get new ones
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                try:
-                    creds.refresh(Request())
-                except Exception as e:
-                    error_msg = str(e)
-                    if 'invalid_grant' in error_msg.lower():
-                        logger.error(f"Token refresh failed: {error_msg}")
-                        logger.error("The refresh token has expired or been revoked.")
-                        logger.error("Please run 'python manual_auth.py' to re-authenticate.")
-                        # Delete the invalid token file
-                        if os.path.exists(self.token_file):
-                            os.remove(self.token_file)
-                            logger.info(f"Removed invalid token file: {self.token_file}")
-                        raise Exception(f"Authentication failed. Please run 'python manual_auth.py' to re-authenticate. Error: {error_msg}")
-                    else:
-                        raise
-            else:
-                logger.error("No valid credentials found. Please run 'python manual_auth.py' to authenticate.")
-                raise Exception("No valid credentials found. Please run 'python manual_auth.py' to authenticate.")
-            
-            # Save credentials for future use
-            with open(self.token_file, 'wb') as token:
-                pickle.dump(creds, token)
+        # Shared with the other services using the same token file
+        creds = get_creds(self.token_file, SCOPES)
         
         # Initialize both services
-        self.service = build('sheets', 'v4', credentials=creds)
+        self.service = build('sheets', 'v4', credentials=creds, http=self.http)
         self.gc = gspread.authorize(creds)
         self.creds = creds  # Store credentials for later use
         logger.info("Google Sheets service authenticated successfully")
     
+    @staticmethod
+    def _retry_delay(error: HttpError, attempt: int) -> float:
+        """
+        Seconds to wait before retrying a failed request.
+        
+        Args:
+            error: The rate limit or server error response
+            attempt: Zero-based number of the attempt that failed
+        
+        Returns:
+            The server's Retry-After if it sent one, capped at MAX_RETRY_AFTER,
+            otherwise exponential backoff
+        """
+        retry_after = error.resp.get('retry-after')
+        if retry_after:
+            try:
+                return min(float(retry_after), MAX_RETRY_AFTER)
+            except ValueError:
+                pass  # An HTTP date; fall back to backoff
+        return float(2 ** attempt)
+    
+    def _execute(self, request, retries: int = 5, idempotent: bool = True):
+        """
+        Execute a Sheets API request, paced by the shared token bucket.
+        
+        Rate limit and server errors are retried with exponential backoff.
+        Rate limit responses also slow the bucket down, so other requests
+        in the process back off too.
+        
+        Args:
+            request: Sheets API request
+            retries: Times to retry on rate limit or server errors
+            idempotent: False for requests such as values.append that a server
+                        error may already have applied; only rate limits,
+                        which reject the request, are retried for those
+        
+        Returns:
+            API response
+        """
+        for attempt in range(retries + 1):
+            self._bucket.acquire()
+            try:
+                return request.execute()
+            except HttpError as error:
+                status = error.resp.status
+                if attempt == retries or (status != 429 and (status < 500 or not idempotent)):
+                    raise
+                delay = self._retry_delay(error, attempt)
+                if status == 429:
+                    logger.warning(f"Sheets rate limit hit, retrying in {delay:.0f}s")
+                    self._bucket.throttle()
+                else:
+                    logger.warning(f"Sheets server error {status}, retrying in {delay:.0f}s")
+                time.sleep(delay)
+    
     def create_spreadsheet(self, 
                           title: str, 
                           folder_id: Optional[str] = None) -> Optional[Dict[str, str]]:
@@ -94,9 +188,9 @@ class GoogleSheetsService:
                 }
             }
             
-            spreadsheet = self.service.spreadsheets().create(
+            spreadsheet = self._execute(self.service.spreadsheets().create(
                 body=spreadsheet_body
-            ).execute()
+            ), idempotent=False)
             
             spreadsheet_id = spreadsheet['spreadsheetId']
             spreadsheet_url = f"https://docs.google.com/spreadsheets/d/{spreadsheet_id}/edit"
@@ -105,7 +199,7 @@ class GoogleSheetsService:
             if folder_id:
                 try:
                     # Use Drive API to move file
-                    drive_service = build('drive', 'v3', credentials=self.creds)
+                    drive_service = build('drive', 'v3', credentials=self.creds, http=self.http)
                     
                     # Get current parents
                     file = drive_service.files().get(
@@ -182,12 +276,12 @@ class GoogleSheetsService:
             }
             
             # Write data
-            result = self.service.spreadsheets().values().update(
+            result = self._execute(self.service.spreadsheets().values().update(
                 spreadsheetId=spreadsheet_id,
                 range=range_name,
                 valueInputOption='RAW',
                 body=body
-            ).execute()
+            ))
             
             cells_updated = result.get('updatedCells', 0)
             logger.info(f"Updated {cells_updated} cells in {range_name}")
@@ -197,7 +291,71 @@ class GoogleSheetsService:
             logger.error(f"Error writing data to sheet: {error}")
             return False
     
-    def format_header_row(self, 
+    @staticmethod
+    def _header_format_request(sheet_id: int = 0, num_columns: int = 7) -> Dict[str, Any]:
+        """
+        Build the batchUpdate request that styles the header row.
+        
+        Args:
+            sheet_id: The sheet ID (0 for first sheet)
+            num_columns: Number of columns to format
+        
+        Returns:
+            A single 'repeatCell' request dictionary
+        """
+        return {
+            'repeatCell': {
+                'range': {
+                    'sheetId': sheet_id,
+                    'startRowIndex': 0,
+                    'endRowIndex': 1,
+                    'startColumnIndex': 0,
+                    'endColumnIndex': num_columns
+                },
+                'cell': {
+                    'userEnteredFormat': {
+                        'backgroundColor': {
+                            'red': 0.2,
+                            'green': 0.6,
+                            'blue': 0.9
+                        },
+                        'textFormat': {
+                            'bold': True,
+                            'foregroundColor': {
+                                'red': 1.0,
+                                'green': 1.0,
+                                'blue': 1.0
+                            }
+                        }
+                    }
+                },
+                'fields': 'userEnteredFormat(backgroundColor,textFormat)'
+            }
+        }
+    
+    @staticmethod
+    def _auto_resize_request(sheet_id: int = 0) -> Dict[str, Any]:
+        """
+        Build the batchUpdate request that auto-resizes columns.
+        
+        Args:
+            sheet_id: The sheet ID (0 for first sheet)
+        
+        Returns:
+            A single 'autoResizeDimensions' request dictionary
+        """
+        return {
+            'autoResizeDimensions': {
+                'dimensions': {
+                    'sheetId': sheet_id,
+                    'dimension': 'COLUMNS',
+                    'startIndex': 0,
+                    'endIndex': 10  # Resize first 10 columns
+                }
+            }
+        }
+    
+    def format_header_row(self,
                          spreadsheet_id: str, 
                          sheet_id: int = 0, 
                          num_columns: int = 7) -> bool:
@@ -213,44 +371,14 @@ class GoogleSheetsService:
             True if successful, False otherwise
         """
         try:
-            requests = [
-                {
-                    'repeatCell': {
-                        'range': {
-                            'sheetId': sheet_id,
-                            'startRowIndex': 0,
-                            'endRowIndex': 1,
-                            'startColumnIndex': 0,
-                            'endColumnIndex': num_columns
-                        },
-                        'cell': {
-                            'userEnteredFormat': {
-                                'backgroundColor': {
-                                    'red': 0.2,
-                                    'green': 0.6,
-                                    'blue': 0.9
-                                },
-                                'textFormat': {
-                                    'bold': True,
-                                    'foregroundColor': {
-                                        'red': 1.0,
-                                        'green': 1.0,
-                                        'blue': 1.0
-                                    }
-                                }
-                            }
-                        },
-                        'fields': 'userEnteredFormat(backgroundColor,textFormat)'
-                    }
-                }
-            ]
+            requests = [self._header_format_request(sheet_id, num_columns)]
             
             body = {'requests': requests}
             
-            self.service.spreadsheets().batchUpdate(
+            self._execute(self.service.spreadsheets().batchUpdate(
                 spreadsheetId=spreadsheet_id,
                 body=body
-            ).execute()
+            ))
             
             logger.info("Header row formatted successfully")
             return True
@@ -273,25 +401,14 @@ class GoogleSheetsService:
             True if successful, False otherwise
         """
         try:
-            requests = [
-                {
-                    'autoResizeDimensions': {
-                        'dimensions': {
-                            'sheetId': sheet_id,
-                            'dimension': 'COLUMNS',
-                            'startIndex': 0,
-                            'endIndex': 10  # Resize first 10 columns
-                        }
-                    }
-                }
-            ]
+            requests = [self._auto_resize_request(sheet_id)]
             
             body = {'requests': requests}
             
-            self.service.spreadsheets().batchUpdate(
+            self._execute(self.service.spreadsheets().batchUpdate(
                 spreadsheetId=spreadsheet_id,
                 body=body
-            ).execute()
+            ))
             
             logger.info("Columns auto-resized successfully")
             return True
@@ -328,16 +445,42 @@ class GoogleSheetsService:
             # Prepare data with headers
             all_data = [headers] + data
             
-            # Write data
-            if not self.write_data_to_sheet(spreadsheet_id, all_data):
-                logger.error("Failed to write data to spreadsheet")
+            # Write headers and data in a single values.batchUpdate call
+            sheet_name = 'Sheet1'
+            body = {
+                'valueInputOption': 'RAW',
+                'data': [{'range': f'{sheet_name}!A1', 'values': all_data}]
+            }
+            
+            try:
+                result = self._execute(self.service.spreadsheets().values().batchUpdate(
+                    spreadsheetId=spreadsheet_id,
+                    body=body
+                ))
+            except HttpError as error:
+                logger.error(f"Failed to write data to spreadsheet: {error}")
                 return None
             
-            # Format header row
-            self.format_header_row(spreadsheet_id, num_columns=len(headers))
+            logger.info(f"Updated {result.get('totalUpdatedCells', 0)} cells in {sheet_name}")
             
-            # Auto-resize columns
-            self.auto_resize_columns(spreadsheet_id)
+            # Format header row and auto-resize columns in one batchUpdate call
+            if tuple(headers) == LEAD_HEADERS:
+                # Copied, so the shared requests can't be changed through this call
+                format_requests = copy.deepcopy(list(HEADER_FORMAT_REQUESTS))
+            else:
+                format_requests = [
+                    self._header_format_request(num_columns=len(headers)),
+                    self._auto_resize_request()
+                ]
+            
+            try:
+                self._execute(self.service.spreadsheets().batchUpdate(
+                    spreadsheetId=spreadsheet_id,
+                    body={'requests': format_requests}
+                ))
+                logger.info("Header row formatted and columns auto-resized")
+            except HttpError as error:
+                logger.warning(f"Error formatting spreadsheet: {error}")
             
             logger.info(f"Successfully created and populated spreadsheet: {title}")
             return sheet_info
@@ -366,6 +509,10 @@ class GoogleSheetsService:
         """
         Append data to the end of a sheet.
         
+        Large data is appended in chunks of at most MAX_CELLS cells. The append
+        is not atomic: if a later chunk fails, the rows from earlier chunks stay
+        in the sheet, and the number written is logged with the error.
+        
         Args:
             spreadsheet_id: The spreadsheet ID
             data: Data to append
@@ -374,27 +521,35 @@ class GoogleSheetsService:
         Returns:
             True if successful, False otherwise
         """
+        rows_written = 0
         try:
             range_name = f"{sheet_name}!A:Z"  # This will append to the end
             
-            body = {
-                'values': data
-            }
+            # Keep each request under the cell cap; every chunk still waits on the rate limiter
+            num_cols = max((len(row) for row in data), default=0) or 1
+            rows_per_chunk = max(1, MAX_CELLS // num_cols)
             
-            result = self.service.spreadsheets().values().append(
-                spreadsheetId=spreadsheet_id,
-                range=range_name,
-                valueInputOption='RAW',
-                insertDataOption='INSERT_ROWS',
-                body=body
-            ).execute()
+            cells_updated = 0
+            for start in range(0, len(data), rows_per_chunk):
+                body = {
+                    'values': data[start:start + rows_per_chunk]
+                }
+                
+                result = self._execute(self.service.spreadsheets().values().append(
+                    spreadsheetId=spreadsheet_id,
+                    range=range_name,
+                    valueInputOption='RAW',
+                    insertDataOption='INSERT_ROWS',
+                    body=body
+                ), idempotent=False)
+                cells_updated += result.get('updates', {}).get('updatedCells', 0)
+                rows_written += len(body['values'])
             
-            cells_updated = result.get('updates', {}).get('updatedCells', 0)
             logger.info(f"Appended {len(data)} rows, updated {cells_updated} cells")
             return True
             
         except HttpError as error:
-            logger.error(f"Error appending data to sheet: {error}")
+            logger.error(f"Error appending data to sheet after writing {rows_written} of {len(data)} rows: {error}")
             return False
     
     def get_existing_data(self, spreadsheet_id: str, sheet_name: str = 'Sheet1') -> List[List[str]]:
@@ -410,10 +565,10 @@ class GoogleSheetsService:
         """
         try:
             range_name = f"{sheet_name}!A:Z"
-            result = self.service.spreadsheets().values().get(
+            result = self._execute(self.service.spreadsheets().values().get(
                 spreadsheetId=spreadsheet_id,
                 range=range_name
-            ).execute()
+            ))
             
             values = result.get('values', [])
             logger.info(f"Retrieved {len(values)} existing rows from sheet '{sheet_name}'")
@@ -427,6 +582,66 @@ class GoogleSheetsService:
             logger.error(f"Error getting existing data: {error}")
             return []
     
+    def get_values(self, spreadsheet_id: str, range_name: str, unformatted: bool = True) -> List[List[Any]]:
+        """
+        Read the values in a range.
+        
+        Unformatted values come back as raw numbers and date serial numbers
+        instead of locale-formatted strings, which keeps responses smaller.
+        
+        Args:
+            spreadsheet_id: The spreadsheet ID
+            range_name: A1 notation range, e.g. 'Sheet1!A2:G4'
+            unformatted: Request unformatted values instead of display strings
+        
+        Returns:
+            List of rows, or empty list if failed
+        """
+        try:
+            options = {}
+            if unformatted:
+                options = {
+                    'valueRenderOption': 'UNFORMATTED_VALUE',
+                    'dateTimeRenderOption': 'SERIAL_NUMBER'
+                }
+            
+            result = self._execute(self.service.spreadsheets().values().get(
+                spreadsheetId=spreadsheet_id,
+                range=range_name,
+                **options
+            ))
+            
+            return result.get('values', [])
+            
+        except HttpError as error:
+            logger.error(f"Error getting range {range_name}: {error}")
+            return []
+    
+    def batch_get(self, spreadsheet_id: str, ranges: List[str]) -> List[Dict[str, Any]]:
+        """
+        Read several ranges in a single request.
+        
+        Args:
+            spreadsheet_id: The spreadsheet ID
+            ranges: A1 notation ranges, e.g. ['Sheet1!A1:G1', 'Sheet1!A2:G4']
+        
+        Returns:
+            List of value ranges in the order requested, or empty list if failed
+        """
+        try:
+            result = self._execute(self.service.spreadsheets().values().batchGet(
+                spreadsheetId=spreadsheet_id,
+                ranges=ranges
+            ))
+            
+            value_ranges = result.get('valueRanges', [])
+            logger.info(f"Retrieved {len(value_ranges)} ranges from spreadsheet {spreadsheet_id}")
+            return value_ranges
+            
+        except HttpError as error:
+            logger.error(f"Error getting ranges {ranges}: {error}")
+            return []
+    
     def append_data_without_duplicates(self, 
                                       spreadsheet_id: str, 
                                       data: List[List[Any]], 
@@ -487,4 +702,11 @@ class GoogleSheetsService:
             
         except Exception as error:
             logger.error(f"Error appending data without duplicates: {error}")
-            return False
\ No newline at end of file
+            return False
+
+
+# Header formatting for the lead data sheets, built once at import
+HEADER_FORMAT_REQUESTS = (
+    GoogleSheetsService._header_format_request(num_columns=len(LEAD_HEADERS)),
+    GoogleSheetsService._auto_resize_request()
+)
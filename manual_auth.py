@@ -5,34 +5,224 @@ This script generates the OAuth tokens without requiring a browser.
 """
 
 import os
-import pickle
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-
-# Define scopes for each service
-GMAIL_SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
-DRIVE_SCOPES = [
-    'https://www.googleapis.com/auth/drive.file',
-    'https://www.googleapis.com/auth/spreadsheets'
-]
-SHEETS_SCOPES = [
-    'https://www.googleapis.com/auth/spreadsheets',
-    'https://www.googleapis.com/auth/drive.file'
-]
-
-def authenticate_service(service_name, scopes, token_file, credentials_file='credentials.json'):
-    """Authenticate a Google service and save the token."""
-    print(f"\n🔐 Authenticating {service_name}...")
-    print("=" * 50)
-    
-    creds = None
+import json
+import atexit
+import sys
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+from _auth import has_scopes, load_token, write_token
+
+# Define scopes for each service (immutable, interned so every token and flow shares them)
+GMAIL_SCOPES = (sys.intern('https://www.googleapis.com/auth/gmail.readonly'),)
+DRIVE_SCOPES = (
+    sys.intern('https://www.googleapis.com/auth/drive.file'),
+    sys.intern('https://www.googleapis.com/auth/spreadsheets')
+)
+SHEETS_SCOPES = (
+    sys.intern('https://www.googleapis.com/auth/spreadsheets'),
+    sys.intern('https://www.googleapis.com/auth/drive.file')
+)
+
+# Drive and Sheets share scopes, so one token covering all services is enough
+ALL_SCOPES = tuple(sorted(set(GMAIL_SCOPES) | set(DRIVE_SCOPES) | set(SHEETS_SCOPES)))
+
+# Refresh still-valid tokens that expire within this many seconds
+REFRESH_WINDOW_SECONDS = 60
+
+# Parsed credentials.json and the (inode, mtime) it was parsed from
+_creds_json_stat = None
+_CLIENT_CONFIG = None
+
+# Credentials already loaded in this process, keyed by token file path
+_CREDS_CACHE = {}
+
+# Credentials waiting to be written, keyed by token file path. Flushed in one
+# pass at the end of main(), or at exit if the script stops early.
+_DIRTY = {}
+
+# Refreshes currently running, keyed by token file path, so concurrent
+# callers for the same token wait on one refresh instead of racing
+_refresh_lock = threading.Lock()
+_refresh_inflight = {}
+
+# One keep-alive session for all token refreshes, created by _get_request()
+_REQUEST = None
+
+def _print_block(*lines):
+    """Print several lines with a single write to stdout."""
+    sys.stdout.write("\n".join(lines) + "\n")
+
+def _load_client_config(credentials_file='credentials.json'):
+    """Return the parsed client secrets, reparsing only if the file changed."""
+    global _creds_json_stat, _CLIENT_CONFIG
+    st = os.stat(credentials_file)
+    file_stat = (st.st_ino, st.st_mtime)
+    if _CLIENT_CONFIG is None or file_stat != _creds_json_stat:
+        with open(credentials_file) as f:
+            _CLIENT_CONFIG = json.load(f)
+        _creds_json_stat = file_stat
+    return _CLIENT_CONFIG
+
+def _save_token(creds, token_file):
+    """Queue credentials to be written to token_file by _flush_dirty()."""
+    _DIRTY[token_file] = creds
+
+def _flush_dirty():
+    """Write all queued tokens as JSON, replacing each token file atomically."""
+    token_dirs = set()
+    while _DIRTY:
+        token_file, creds = _DIRTY.popitem()
+        write_token(creds, token_file)
+        token_dirs.add(os.path.dirname(os.path.abspath(token_file)))
+        print(f"💾 Token saved to {token_file}")
+    
+    # Make the renames durable with one sync per directory (not supported on Windows)
+    if os.name == 'posix':
+        for token_dir in token_dirs:
+            dir_fd = os.open(token_dir, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+atexit.register(_flush_dirty)
+
+def _get_request():
+    """Return the shared refresh Request, importing the HTTP stack on first use."""
+    global _REQUEST
+    with _refresh_lock:
+        if _REQUEST is None:
+            import requests
+            from google.auth.transport.requests import Request
+            
+            # Keep-alive session reused by every refresh in this process
+            _REQUEST = Request(session=requests.Session())
+    return _REQUEST
+
+def _refresh_credentials(creds, token_file):
+    """Refresh creds, sharing a single in-flight refresh per token file."""
+    with _refresh_lock:
+        future = _refresh_inflight.get(token_file)
+        is_owner = future is None
+        if is_owner:
+            future = Future()
+            _refresh_inflight[token_file] = future
+    
+    if not is_owner:
+        return future.result()
+    
+    try:
+        creds.refresh(_get_request())
+        future.set_result(creds)
+    except Exception as e:
+        future.set_exception(e)
+    finally:
+        with _refresh_lock:
+            del _refresh_inflight[token_file]
+    
+    return future.result()
+
+def _refresh_if_expiring(service_name, creds, token_file):
+    """Refresh valid credentials that are about to expire and save them."""
+    if not creds.expiry or not creds.refresh_token:
+        return creds
+    
+    # google-auth stores expiry as a naive UTC datetime
+    remaining = (creds.expiry - datetime.utcnow()).total_seconds()
+    if remaining >= REFRESH_WINDOW_SECONDS:
+        return creds
+    
+    try:
+        creds = _refresh_credentials(creds, token_file)
+        _save_token(creds, token_file)
+        print(f"✅ {service_name} token refreshed ahead of expiry!")
+    except Exception as e:
+        # The current token is still valid, so keep using it
+        print(f"⚠️ Early token refresh failed, using current token: {e}")
+    return creds
+
+def _run_console(flow):
+    """Authenticate with the library's console-based flow."""
+    return flow.run_console()
+
+def _run_with_pasted_code(flow, redirect_uri, steps):
+    """Show the authorization URL, then exchange the code the user pastes back."""
+    flow.redirect_uri = redirect_uri
+    
+    auth_url, _ = flow.authorization_url(prompt='consent')
+    _print_block(
+        f"\n🔗 Authorization URL:",
+        auth_url,
+        "\nSteps:",
+        *steps,
+        "\n" + "="*50
+    )
+    
+    auth_code = input("📝 Enter the authorization code: ").strip()
+    flow.fetch_token(code=auth_code)
+    return flow.credentials
+
+def _run_oob(flow):
+    """Authenticate manually using the out-of-band redirect."""
+    return _run_with_pasted_code(flow, 'urn:ietf:wg:oauth:2.0:oob', (
+        "1. Copy the URL above and open it in a web browser",
+        "2. Sign in to your Google account",
+        "3. Grant the requested permissions",
+        "4. Copy the authorization code from the browser",
+        "5. Paste it back here"
+    ))
+
+def _run_localhost(flow):
+    """Authenticate manually using a localhost redirect."""
+    return _run_with_pasted_code(flow, 'http://localhost:8080', (
+        "1. Copy the URL above and open it in a web browser",
+        "2. Sign in and grant permissions",
+        "3. After redirect, copy the 'code' parameter from the URL",
+        "4. Paste it back here"
+    ))
+
+# Interactive authentication methods, tried in order until one succeeds
+_AUTH_METHODS = (
+    ("Console", "console-based authentication", _run_console),
+    ("OOB", "manual authentication with OOB redirect", _run_oob),
+    ("Localhost", "authentication with localhost redirect", _run_localhost),
+)
+
+def authenticate_service(service_name, scopes, token_file, client_config):
+    """Authenticate a Google service and save the token.
+    
+    client_config is the parsed contents of credentials.json, loaded once by main().
+    """
+    _print_block(
+        f"\n🔐 Authenticating {service_name}...",
+        "=" * 50
+    )
+    
+    # Reuse credentials this process has already loaded for the token file
+    creds = _CREDS_CACHE.get(token_file)
+    if creds and not has_scopes(creds, scopes):
+        creds = None
+    if creds and creds.valid:
+        _CREDS_CACHE[token_file] = _refresh_if_expiring(service_name, creds, token_file)
+        print(f"✅ {service_name} already authenticated!")
+        return True
     
     # Check if token already exists and is valid
-    if os.path.exists(token_file):
-        with open(token_file, 'rb') as token:
-            creds = pickle.load(token)
+    if not creds:
+        creds, is_legacy = load_token(token_file)
+        
+        if creds and not has_scopes(creds, scopes):
+            # e.g. a Gmail-only token from before Drive and Sheets shared it
+            print(f"⚠️ Existing token is missing scopes for {service_name}, re-authenticating")
+            creds = None
         
         if creds and creds.valid:
+            creds = _refresh_if_expiring(service_name, creds, token_file)
+            # One-time migration of legacy pickled tokens to JSON
+            if is_legacy:
+                _save_token(creds, token_file)
+            _CREDS_CACHE[token_file] = creds
             print(f"✅ {service_name} already authenticated!")
             return True
     
@@ -40,126 +230,99 @@ def authenticate_service(service_name, scopes, token_file, credentials_file='cre
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
             try:
-                creds.refresh(Request())
+                creds = _refresh_credentials(creds, token_file)
                 print(f"✅ {service_name} token refreshed!")
             except Exception as e:
                 print(f"❌ Failed to refresh token: {e}")
+                _CREDS_CACHE.pop(token_file, None)
                 creds = None
         
         if not creds:
-            # Use console-based OAuth flow
-            flow = InstalledAppFlow.from_client_secrets_file(credentials_file, scopes)
+            # Only the interactive path needs the OAuth flow machinery
+            from google_auth_oauthlib.flow import InstalledAppFlow
             
-            print(f"\n📋 Manual authentication required for {service_name}")
-            print("Trying different authentication methods...")
-            print("\n" + "="*50)
+            flow = InstalledAppFlow.from_client_config(client_config, scopes)
             
-            # Method 1: Try console-based flow first
-            try:
-                print("🔄 Attempting console-based authentication...")
-                creds = flow.run_console()
-                print(f"✅ {service_name} authenticated successfully with console method!")
-            except Exception as e:
-                print(f"❌ Console method failed: {e}")
-                
-                # Method 2: Try manual method with OOB redirect
+            _print_block(
+                f"\n📋 Manual authentication required for {service_name}",
+                "Trying different authentication methods...",
+                "\n" + "="*50
+            )
+            
+            # Try each method in turn, keeping the errors for the final report
+            errors = []
+            for method_name, description, run_method in _AUTH_METHODS:
                 try:
-                    print("🔄 Attempting manual authentication with OOB redirect...")
-                    flow.redirect_uri = 'urn:ietf:wg:oauth:2.0:oob'
-                    
-                    auth_url, _ = flow.authorization_url(prompt='consent')
-                    print(f"\n🔗 Authorization URL:")
-                    print(auth_url)
-                    print("\nSteps:")
-                    print("1. Copy the URL above and open it in a web browser")
-                    print("2. Sign in to your Google account")
-                    print("3. Grant the requested permissions")
-                    print("4. Copy the authorization code from the browser")
-                    print("5. Paste it back here")
-                    print("\n" + "="*50)
-                    
-                    auth_code = input("📝 Enter the authorization code: ").strip()
-                    flow.fetch_token(code=auth_code)
-                    creds = flow.credentials
-                    print(f"✅ {service_name} authenticated successfully with manual method!")
-                    
-                except Exception as e2:
-                    print(f"❌ Manual OOB method failed: {e2}")
-                    
-                    # Method 3: Try with localhost redirect
-                    try:
-                        print("🔄 Attempting authentication with localhost redirect...")
-                        flow = InstalledAppFlow.from_client_secrets_file(credentials_file, scopes)
-                        flow.redirect_uri = 'http://localhost:8080'
-                        
-                        auth_url, _ = flow.authorization_url(prompt='consent')
-                        print(f"\n🔗 Authorization URL:")
-                        print(auth_url)
-                        print("\nSteps:")
-                        print("1. Copy the URL above and open it in a web browser")
-                        print("2. Sign in and grant permissions")
-                        print("3. After redirect, copy the 'code' parameter from the URL")
-                        print("4. Paste it back here")
-                        print("\n" + "="*50)
-                        
-                        auth_code = input("📝 Enter the authorization code: ").strip()
-                        flow.fetch_token(code=auth_code)
-                        creds = flow.credentials
-                        print(f"✅ {service_name} authenticated successfully with localhost method!")
-                        
-                    except Exception as e3:
-                        print(f"❌ All authentication methods failed!")
-                        print(f"Console error: {e}")
-                        print(f"OOB error: {e2}")
-                        print(f"Localhost error: {e3}")
-                        print("\n💡 Suggestion: Check your Google Cloud Console OAuth configuration")
-                        print("   Make sure your OAuth client is configured as 'Desktop Application'")
-                        return False
+                    print(f"🔄 Attempting {description}...")
+                    creds = run_method(flow)
+                    print(f"✅ {service_name} authenticated successfully with {method_name} method!")
+                    break
+                except Exception as e:
+                    print(f"❌ {method_name} method failed: {e}")
+                    errors.append(f"{method_name} error: {e}")
+            else:
+                _print_block(
+                    f"❌ All authentication methods failed!",
+                    *errors,
+                    "\n💡 Suggestion: Check your Google Cloud Console OAuth configuration",
+                    "   Make sure your OAuth client is configured as 'Desktop Application'"
+                )
+                return False
         
         # Save credentials for future use
-        with open(token_file, 'wb') as token:
-            pickle.dump(creds, token)
-        print(f"💾 {service_name} token saved to {token_file}")
+        _save_token(creds, token_file)
+        _CREDS_CACHE[token_file] = creds
     
     return True
 
 def main():
     """Main authentication function."""
-    print("🚀 Manual Google API Authentication")
-    print("=" * 50)
-    print("This script will authenticate with Google APIs without requiring a browser on the server.")
-    print("You'll need to copy URLs to a web browser and paste back authorization codes.")
-    print("\nMake sure you have 'credentials.json' in the current directory.")
-    
-    if not os.path.exists('credentials.json'):
-        print("\n❌ Error: credentials.json not found!")
-        print("Please download your Google API credentials and save them as 'credentials.json'")
+    _print_block(
+        "🚀 Manual Google API Authentication",
+        "=" * 50,
+        "This script will authenticate with Google APIs without requiring a browser on the server.",
+        "You'll need to copy URLs to a web browser and paste back authorization codes.",
+        "\nMake sure you have 'credentials.json' in the current directory."
+    )
+    
+    # Parse the client secrets once and share them with every service's flow
+    try:
+        client_config = _load_client_config()
+    except FileNotFoundError:
+        _print_block(
+            "\n❌ Error: credentials.json not found!",
+            "Please download your Google API credentials and save them as 'credentials.json'"
+        )
         return False
     
     print("\n✅ Found credentials.json")
     
-    # Authenticate each service
+    # Gmail, Drive and Sheets all use a single token with the combined scopes
     services = [
-        ("Gmail", GMAIL_SCOPES, "token.json"),
-        ("Google Drive", DRIVE_SCOPES, "drive_token.json"),
-        ("Google Sheets", SHEETS_SCOPES, "sheets_token.json")
+        ("Google (Gmail, Drive, Sheets)", ALL_SCOPES, "token.json")
     ]
     
     success_count = 0
     for service_name, scopes, token_file in services:
-        if authenticate_service(service_name, scopes, token_file):
+        if authenticate_service(service_name, scopes, token_file, client_config):
             success_count += 1
         else:
             print(f"❌ Failed to authenticate {service_name}")
     
-    print(f"\n🎉 Authentication Summary")
-    print("=" * 50)
-    print(f"✅ Successfully authenticated: {success_count}/3 services")
+    _flush_dirty()
+    
+    _print_block(
+        f"\n🎉 Authentication Summary",
+        "=" * 50,
+        f"✅ Successfully authenticated: {success_count}/{len(services)} services"
+    )
     
-    if success_count == 3:
-        print("🎯 All services authenticated! You can now run:")
-        print("   python email_processor.py --test-auth")
-        print("   python email_processor.py --check-in-2min")
+    if success_count == len(services):
+        _print_block(
+            "🎯 All services authenticated! You can now run:",
+            "   python email_processor.py --test-auth",
+            "   python email_processor.py --check-in-2min"
+        )
         return True
     else:
         print("❌ Some services failed to authenticate. Please try again.")
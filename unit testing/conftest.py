@@ -0,0 +1,67 @@
+"""
+Shared pytest fixtures for the unit tests.
+"""
+
+import os
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+
+# Environment variables read by EmailProcessor in the mocked workflow tests
+MOCK_ENV = {
+    'GMAIL_CREDENTIALS_FILE': 'credentials.json',
+    'GMAIL_TOKEN_FILE': 'token.json',
+    'GMAIL_FROM_EMAIL': 'growatorchard@gmail.com',
+    'GMAIL_SUBJECT_FILTER': 'MatrixCare Automation for Looker Dash',
+    'GOOGLE_DRIVE_FOLDER_ID': '1xrzn2LZ-URdb1nx_7MspHyytq6LVk1iq',
+    'GOOGLE_SHEETS_SPREADSHEET_ID': 'your_actual_spreadsheet_id_here',
+    'LOG_LEVEL': 'INFO'
+}
+
+
+@pytest.fixture(scope='session')
+def sheets_service():
+    """Authenticated Google Sheets service, shared by every test in the run."""
+    from google_sheets_service import GoogleSheetsService
+    
+    credentials_file = os.getenv('GOOGLE_SHEETS_CREDENTIALS_FILE', 'credentials.json')
+    if not os.path.exists(credentials_file):
+        pytest.skip(f"Credentials file not found: {credentials_file}")
+    
+    return GoogleSheetsService(credentials_file)
+
+
+@pytest.fixture
+def local_sheets_service():
+    """GoogleSheetsService with a mocked API, built without authenticating.
+    
+    It gets its own fast token bucket, so tests neither wait on nor drain the shared one.
+    """
+    from google_sheets_service import GoogleSheetsService, TokenBucket
+    
+    sheets_service = GoogleSheetsService.__new__(GoogleSheetsService)  # Create without __init__
+    sheets_service.service = MagicMock()
+    sheets_service._bucket = TokenBucket(rate=1000.0, capacity=1000)
+    return sheets_service
+
+
+@pytest.fixture(scope='class')
+def mock_gmail_stack():
+    """Set the test environment and replace EmailProcessor's services with mocks, once per class."""
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        for key, value in MOCK_ENV.items():
+            monkeypatch.setenv(key, value)
+        
+        mocks = SimpleNamespace(
+            gmail=MagicMock(),
+            drive=MagicMock(),
+            sheets=MagicMock(),
+            csv=MagicMock()
+        )
+        monkeypatch.setattr('email_processor.GmailService', mocks.gmail)
+        monkeypatch.setattr('email_processor.GoogleDriveService', mocks.drive)
+        monkeypatch.setattr('email_processor.GoogleSheetsService', mocks.sheets)
+        monkeypatch.setattr('email_processor.CSVProcessor', mocks.csv)
+        
+        yield mocks
@@ -8,7 +8,6 @@ and verifies the MatrixCare Looker Dashboard automation works.
 
 import os
 import sys
-import subprocess
 
 def main():
     """Run the MatrixCare test."""
@@ -20,49 +19,28 @@ def main():
     
     # Change to the test directory
     os.chdir(test_dir)
+    if test_dir not in sys.path:
+        sys.path.insert(0, test_dir)
     
-    # Run the specific test
+    # The schedule tests use pytest fixtures, so pytest is required
     try:
-        print("Running MatrixCare schedule test...")
-        result = subprocess.run([
-            sys.executable, 
-            '-m', 'pytest', 
-            'test_matrixcare_schedule.py', 
-            '-v', 
-            '--tb=short'
-        ], capture_output=True, text=True)
-        
-        print("STDOUT:")
-        print(result.stdout)
-        
-        if result.stderr:
-            print("STDERR:")
-            print(result.stderr)
-        
-        if result.returncode == 0:
-            print("\n✅ All tests passed!")
-        else:
-            print(f"\n❌ Tests failed with return code: {result.returncode}")
-            
-    except FileNotFoundError:
-        # If pytest is not available, try running with unittest
-        print("Pytest not found, running with unittest...")
-        result = subprocess.run([
-            sys.executable, 
-            'test_matrixcare_schedule.py'
-        ], capture_output=True, text=True)
-        
-        print("STDOUT:")
-        print(result.stdout)
-        
-        if result.stderr:
-            print("STDERR:")
-            print(result.stderr)
-        
-        if result.returncode == 0:
-            print("\n✅ All tests passed!")
-        else:
-            print(f"\n❌ Tests failed with return code: {result.returncode}")
+        import pytest
+    except ImportError:
+        print("❌ pytest is required to run the MatrixCare test: pip install pytest")
+        sys.exit(1)
+    
+    # Run the specific test in this process; pytest writes its own output
+    print("Running MatrixCare schedule test...")
+    returncode = pytest.main([
+        'test_matrixcare_schedule.py',
+        '-v',
+        '--tb=short'
+    ])
+    
+    if returncode == 0:
+        print("\n✅ All tests passed!")
+    else:
+        print(f"\n❌ Tests failed with return code: {returncode}")
 
 if __name__ == '__main__':
     main()
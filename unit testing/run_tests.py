@@ -3,64 +3,116 @@ Test runner script with additional test utilities.
 """
 
 import unittest
+import subprocess
 import sys
 import os
-from io import StringIO
+from importlib.util import find_spec
 
-def run_specific_test(test_class=None, test_method=None):
-    """Run specific test class or method."""
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+TEST_MODULE = 'test_email_processor'
+# Live smoke tests; each module's test function shares the module's name
+E2E_MODULES = ('test_credentials', 'test_append_functionality')
+
+def _pytest_target(test_class=None, test_method=None):
+    """Build the pytest node id for a test module, class or method."""
+    target = f'{TEST_MODULE}.py'
+    if test_class:
+        target += f'::{test_class}'
+        if test_method:
+            target += f'::{test_method}'
+    return target
+
+def _e2e_targets(test_class=None):
+    """Live smoke test modules to add to a full run when RUN_E2E=1."""
+    if test_class or os.getenv('RUN_E2E') != '1':
+        return []
+    return [f'{module}.py' for module in E2E_MODULES]
+
+def _xdist_available():
+    """Check whether pytest and pytest-xdist are installed."""
+    return find_spec('pytest') is not None and find_spec('xdist') is not None
+
+def run_sequential_test(test_class=None, test_method=None):
+    """Run specific test class or method in this process with unittest."""
     if test_class and test_method:
-        suite = unittest.TestLoader().loadTestsFromName(f'{test_class}.{test_method}', module=__import__('test_email_processor'))
+        suite = unittest.TestLoader().loadTestsFromName(f'{test_class}.{test_method}', module=__import__(TEST_MODULE))
     elif test_class:
-        suite = unittest.TestLoader().loadTestsFromName(test_class, module=__import__('test_email_processor'))
+        suite = unittest.TestLoader().loadTestsFromName(test_class, module=__import__(TEST_MODULE))
     else:
-        suite = unittest.TestLoader().loadTestsFromModule(__import__('test_email_processor'))
+        suite = unittest.TestLoader().loadTestsFromModule(__import__(TEST_MODULE))
+        for module in _e2e_targets():
+            name = module[:-len('.py')]
+            suite.addTest(unittest.FunctionTestCase(getattr(__import__(name), name)))
     
-    runner = unittest.TextTestRunner(verbosity=2)
+    # Captured stdout is only written out for failing tests
+    runner = unittest.TextTestRunner(verbosity=1, buffer=True)
     result = runner.run(suite)
     return result.wasSuccessful()
 
+def run_specific_test(test_class=None, test_method=None):
+    """Run specific test class or method across all CPU cores with pytest-xdist."""
+    if not _xdist_available():
+        print("pytest-xdist not installed. Running tests sequentially.")
+        return run_sequential_test(test_class, test_method)
+    
+    result = subprocess.run([
+        sys.executable,
+        '-m', 'pytest',
+        '-n', 'auto',
+        # Tests in the google_api xdist group share one worker, so they stay within the API quota
+        '--dist', 'loadgroup',
+        '-p', 'no:cacheprovider',
+        _pytest_target(test_class, test_method),
+        *_e2e_targets(test_class)
+    ], cwd=TEST_DIR)
+    return result.returncode == 0
+
 def run_coverage_test():
     """Run tests with coverage report if coverage is available."""
-    try:
-        import coverage
-        
-        cov = coverage.Coverage()
-        cov.start()
-        
-        # Run tests
-        suite = unittest.TestLoader().loadTestsFromModule(__import__('test_email_processor'))
-        runner = unittest.TextTestRunner(verbosity=2)
-        result = runner.run(suite)
-        
-        cov.stop()
-        cov.save()
-        
-        print("\n" + "="*50)
-        print("COVERAGE REPORT")
-        print("="*50)
-        cov.report()
-        
-        return result.wasSuccessful()
-        
-    except ImportError:
+    if find_spec('coverage') is None or find_spec('pytest_cov') is None:
         print("Coverage module not installed. Running tests without coverage.")
         return run_specific_test()
 
+    if not _xdist_available():
+        print("pytest-xdist not installed. Running tests with coverage sequentially.")
+        xdist_args = []
+    else:
+        xdist_args = ['-n', 'auto', '--dist', 'loadgroup']
+    
+    # pytest-cov combines the per-worker data files before reporting
+    result = subprocess.run([
+        sys.executable,
+        '-m', 'pytest',
+        *xdist_args,
+        '-p', 'no:cacheprovider',
+        '--cov', os.path.dirname(TEST_DIR),
+        '--cov-report', 'term',
+        _pytest_target(),
+        *_e2e_targets()
+    ], cwd=TEST_DIR)
+    return result.returncode == 0
+
 if __name__ == '__main__':
-    if len(sys.argv) > 1:
-        if sys.argv[1] == '--coverage':
+    args = sys.argv[1:]
+    if '--e2e' in args:
+        # Set before any test module is imported or spawned
+        args.remove('--e2e')
+        os.environ['RUN_E2E'] = '1'
+    
+    if args:
+        if args[0] == '--coverage':
             success = run_coverage_test()
-        elif sys.argv[1] == '--help':
+        elif args[0] == '--help':
             print("Usage:")
             print("  python run_tests.py                    # Run all tests")
             print("  python run_tests.py --coverage         # Run with coverage")
+            print("  python run_tests.py --e2e              # Also run live Google API smoke tests")
             print("  python run_tests.py TestClassName      # Run specific test class")
             print("  python run_tests.py TestClass.method   # Run specific test method")
             sys.exit(0)
         else:
             # Parse test class/method
-            test_arg = sys.argv[1]
+            test_arg = args[0]
             if '.' in test_arg:
                 test_class, test_method = test_arg.split('.', 1)
                 success = run_specific_test(test_class, test_method)
@@ -6,7 +6,9 @@ This script creates a test spreadsheet and tests appending data to it.
 
 import os
 import sys
+import unittest
 from datetime import datetime
+from uuid import uuid4
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -14,40 +16,44 @@ load_dotenv()
 
 from google_sheets_service import GoogleSheetsService
 
+# Running this script directly is an explicit request for the live test
+E2E_ENABLED = __name__ == '__main__' or os.getenv('RUN_E2E') == '1'
+
+@unittest.skipUnless(E2E_ENABLED, 'E2E disabled; set RUN_E2E=1 to run')
 def test_append_functionality():
     """Test the append functionality with a sample spreadsheet."""
     
-    print("🧪 Testing Google Sheets append functionality...")
+    # Collect output and write it once at the end
+    messages = ["🧪 Testing Google Sheets append functionality..."]
     
     try:
         # Initialize the sheets service
-        sheets_service = GoogleSheetsService('credentials.json', 'sheets_token.json')
-        print("✅ Google Sheets service initialized")
+        sheets_service = GoogleSheetsService('credentials.json', 'token.json')
+        messages.append("✅ Google Sheets service initialized")
         
         # Create a test spreadsheet
-        test_title = f"Test Append Functionality - {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')}"
+        # Unique per run so parallel workers never share a spreadsheet
+        test_title = f"Test Append Functionality - {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')} {uuid4().hex[:8]}"
         headers = ['LeadCreationDate', 'InquiryDate', 'CommunityName', 'Classification', 'TotalLeads', 'SubSourceName', 'SourceName']
         initial_data = [
             ['2024-01-01', '2024-01-01', 'Test Community 1', 'Hot', '5', 'Web', 'Google'],
             ['2024-01-02', '2024-01-02', 'Test Community 2', 'Warm', '3', 'Email', 'Newsletter']
         ]
         
-        print("📊 Creating test spreadsheet...")
+        messages.append("📊 Creating test spreadsheet...")
         sheet_info = sheets_service.create_and_populate_spreadsheet(
             title=test_title,
             headers=headers,
             data=initial_data
         )
         
-        if not sheet_info:
-            print("❌ Failed to create test spreadsheet")
-            return False
+        assert sheet_info, "Failed to create test spreadsheet"
         
-        print(f"✅ Created test spreadsheet: {sheet_info['id']}")
-        print(f"📝 URL: {sheet_info['url']}")
+        messages.append(f"✅ Created test spreadsheet: {sheet_info['id']}")
+        messages.append(f"📝 URL: {sheet_info['url']}")
         
         # Test appending data
-        print("\n📝 Testing append functionality...")
+        messages.append("\n📝 Testing append functionality...")
         append_data = [
             ['2024-01-03', '2024-01-03', 'Test Community 3', 'Cold', '2', 'Social', 'Facebook'],
             ['2024-01-04', '2024-01-04', 'Test Community 4', 'Hot', '8', 'Referral', 'Word of mouth']
@@ -59,19 +65,18 @@ def test_append_functionality():
             sheet_name='Sheet1'
         )
         
-        if success:
-            print("✅ Successfully appended data to spreadsheet")
-            print(f"🎉 Test completed! Check the spreadsheet: {sheet_info['url']}")
-            print(f"\n💡 To use append mode in the email processor, set this in your .env file:")
-            print(f"GOOGLE_SHEETS_SPREADSHEET_ID={sheet_info['id']}")
-            return True
-        else:
-            print("❌ Failed to append data to spreadsheet")
-            return False
-            
+        assert success, "Failed to append data to spreadsheet"
+        
+        messages.append("✅ Successfully appended data to spreadsheet")
+        messages.append(f"🎉 Test completed! Check the spreadsheet: {sheet_info['url']}")
+        messages.append(f"\n💡 To use append mode in the email processor, set this in your .env file:")
+        messages.append(f"GOOGLE_SHEETS_SPREADSHEET_ID={sheet_info['id']}")
+        
     except Exception as e:
-        print(f"❌ Error during testing: {e}")
-        return False
+        messages.append(f"❌ Error during testing: {e}")
+        raise
+    finally:
+        print('\n'.join(messages))
 
 def main():
     """Main entry point."""
@@ -82,13 +87,13 @@ def main():
         print("❌ credentials.json not found. Please ensure Google API credentials are set up.")
         sys.exit(1)
     
-    success = test_append_functionality()
-    
-    if success:
-        print("\n✅ All tests passed!")
-    else:
+    try:
+        test_append_functionality()
+    except Exception:
         print("\n❌ Tests failed!")
         sys.exit(1)
+    
+    print("\n✅ All tests passed!")
 
 if __name__ == '__main__':
     main()
@@ -3,26 +3,37 @@ Quick test script to verify your credentials are working.
 """
 
 import os
+import unittest
 from gmail_service import GmailService
 from google_drive_service import GoogleDriveService
+from google_discovery import GoogleClientPool
 
+# Running this script directly is an explicit request for the live test
+E2E_ENABLED = __name__ == '__main__' or os.getenv('RUN_E2E') == '1'
+
+@unittest.skipUnless(E2E_ENABLED, 'E2E disabled; set RUN_E2E=1 to run')
 def test_credentials():
     """Test if credentials work for both services."""
+    # Collect output and write it once at the end
+    messages = []
     try:
-        print("🔍 Testing Gmail API...")
+        messages.append("🔍 Testing Gmail API...")
         gmail = GmailService('credentials.json', 'token.json')
-        print("✅ Gmail API authentication successful!")
+        messages.append("✅ Gmail API authentication successful!")
         
-        print("\n🔍 Testing Google Drive API...")
-        drive = GoogleDriveService('credentials.json', 'drive_token.json')
-        print("✅ Google Drive API authentication successful!")
+        messages.append("\n🔍 Testing Google Drive API...")
+        # Reuse Gmail's credentials and a single connection for Drive
+        pool = GoogleClientPool(gmail.creds)
+        drive = GoogleDriveService('credentials.json', 'token.json', http=pool.http)
+        messages.append("✅ Google Drive API authentication successful!")
         
-        print("\n🎉 All credentials are working correctly!")
-        return True
+        messages.append("\n🎉 All credentials are working correctly!")
         
     except Exception as e:
-        print(f"❌ Error: {e}")
-        return False
+        messages.append(f"❌ Error: {e}")
+        raise
+    finally:
+        print('\n'.join(messages))
 
 if __name__ == "__main__":
     test_credentials()
@@ -4,71 +4,119 @@ Unit tests for the email processor components.
 
 import unittest
 import os
-import json
 import base64
-from unittest.mock import Mock, patch, MagicMock
-from io import BytesIO
+import tracemalloc
+from unittest.mock import Mock, patch, MagicMock, mock_open
+from io import BytesIO, RawIOBase
 import tempfile
+from types import SimpleNamespace
+
+from googleapiclient.errors import HttpError
 
 # Import our modules
+import _auth
+from _auth import get_creds
 from gmail_service import GmailService
 from google_drive_service import GoogleDriveService
 from csv_processor import CSVProcessor
 from email_processor import EmailProcessor
 
+# Sample lead export shared by the CSV processing tests
+TEST_CSV = """LeadCreationDate,InquiryDate,CommunityName,Classification,TotalLeads,SubSourceName,SourceName
+2023-12-01,2023-12-01,Test Community,Hot Lead,1,Online,Website
+2023-12-02,2023-12-02,Another Community,Warm Lead,2,Referral,Agent"""
+
+# Encoded once at import rather than in every test
+_CSV_BYTES = TEST_CSV.encode('utf-8')
+_ATTACHMENT_DATA = b"test,csv,data"
+_ENCODED_ATTACHMENT = base64.urlsafe_b64encode(_ATTACHMENT_DATA).decode()
+_OUTPUT_EXPECTED_FRAGMENTS = tuple(
+    fragment.encode('utf-8') for fragment in ('LeadCreationDate', 'Test Community', 'Hot Lead')
+)
+
+# Environment variables read by EmailProcessor, set once for the whole module
+_ENV = {
+    'GMAIL_CREDENTIALS_FILE': 'test_credentials.json',
+    'GMAIL_TOKEN_FILE': 'test_token.json',
+    'GMAIL_FROM_EMAIL': 'test@example.com',
+    'GMAIL_SUBJECT_FILTER': 'Test',
+    'GMAIL_LABEL': 'INBOX',
+    'GOOGLE_DRIVE_CREDENTIALS_FILE': 'test_credentials.json',
+    'CHECK_INTERVAL_MINUTES': '5',
+    'MAX_ROWS_TO_PROCESS': '100',
+    'LOG_LEVEL': 'INFO',
+    'LOG_FILE': 'test.log'
+}
+_saved_env = {}
+
+
+def setUpModule():
+    """Set the test environment."""
+    _saved_env.update({key: os.environ.get(key) for key in _ENV})
+    os.environ.update(_ENV)
+
+
+def tearDownModule():
+    """Restore the original environment."""
+    for key, value in _saved_env.items():
+        if value is None:
+            os.environ.pop(key, None)
+        else:
+            os.environ[key] = value
+
 
 class TestGmailService(unittest.TestCase):
     """Test cases for Gmail service."""
     
+    @classmethod
+    def setUpClass(cls):
+        """Build the fixed API responses once; they are never modified."""
+        cls._response_mock = {
+            'messages': [
+                {'id': 'msg1'},
+                {'id': 'msg2'}
+            ]
+        }
+        
+        # Fixed users().messages().list().execute() chain; plain attribute
+        # lookups instead of MagicMock's child-mock machinery
+        response = cls._response_mock
+        cls._gmail_api = SimpleNamespace(users=lambda: SimpleNamespace(
+            messages=lambda: SimpleNamespace(
+                list=lambda **_: SimpleNamespace(execute=lambda: response))))
+    
     def setUp(self):
         """Set up test fixtures."""
         self.mock_credentials_file = 'test_credentials.json'
         self.mock_token_file = 'test_token.json'
+        # Fresh mocks per test; a copy of a shared Mock would share its children
+        self._creds_mock = Mock(valid=True)
+        self._service_mock = Mock()
     
     @patch('gmail_service.build')
-    @patch('gmail_service.pickle.load')
-    @patch('gmail_service.os.path.exists')
-    @patch('builtins.open', create=True)
-    def test_authenticate_success(self, mock_open, mock_exists, mock_pickle_load, mock_build):
+    @patch('gmail_service.get_creds')
+    def test_authenticate_success(self, mock_get_creds, mock_build):
         """Test successful Gmail authentication."""
         # Mock existing token
-        mock_exists.return_value = True
-        mock_creds = Mock()
-        mock_creds.valid = True
-        mock_pickle_load.return_value = mock_creds
+        mock_creds = self._creds_mock
+        mock_get_creds.return_value = mock_creds
         
         # Mock Gmail service
-        mock_service = Mock()
+        mock_service = self._service_mock
         mock_build.return_value = mock_service
         
         gmail_service = GmailService(self.mock_credentials_file, self.mock_token_file)
         
         self.assertEqual(gmail_service.service, mock_service)
-        mock_build.assert_called_once_with('gmail', 'v1', credentials=mock_creds)
+        mock_build.assert_called_once_with('gmail', 'v1', credentials=mock_creds, http=None)
     
     @patch('gmail_service.build')
-    @patch('gmail_service.pickle.load')
-    @patch('gmail_service.os.path.exists')
-    @patch('builtins.open', create=True)
-    def test_search_emails(self, mock_open, mock_exists, mock_pickle_load, mock_build):
+    @patch('gmail_service.get_creds')
+    def test_search_emails(self, mock_get_creds, mock_build):
         """Test email search functionality."""
         # Setup mocks
-        mock_exists.return_value = True
-        mock_creds = Mock()
-        mock_creds.valid = True
-        mock_pickle_load.return_value = mock_creds
-        
-        mock_service = Mock()
-        mock_build.return_value = mock_service
-        
-        # Mock search response
-        mock_response = {
-            'messages': [
-                {'id': 'msg1'},
-                {'id': 'msg2'}
-            ]
-        }
-        mock_service.users().messages().list().execute.return_value = mock_response
+        mock_get_creds.return_value = self._creds_mock
+        mock_build.return_value = self._gmail_api
         
         gmail_service = GmailService(self.mock_credentials_file, self.mock_token_file)
         result = gmail_service.search_emails(
@@ -79,44 +127,128 @@ class TestGmailService(unittest.TestCase):
         
         self.assertEqual(result, ['msg1', 'msg2'])
     
+    def test_get_messages_with_attachments_batch(self):
+        """Test messages and attachments are fetched in chunked batches."""
+        gmail_service = GmailService.__new__(GmailService)  # Create without __init__
+        batches = []
+        
+        def message(**kwargs):
+            return {'payload': {
+                'headers': [{'name': 'Subject', 'value': kwargs['id']}],
+                'parts': [{'filename': 'leads.csv', 'mimeType': 'text/csv',
+                           'body': {'attachmentId': f"att-{kwargs['id']}"}}]
+            }}
+        
+        class _Batch:
+            """Batch request stand-in that answers every call on execute()."""
+            def __init__(self, callback):
+                self.callback = callback
+                self.requests = []
+                batches.append(self)
+            
+            def add(self, request, request_id):
+                self.requests.append((request_id, request))
+            
+            def execute(self):
+                for request_id, request in self.requests:
+                    self.callback(request_id, request(), None)
+        
+        messages_api = SimpleNamespace(
+            get=lambda **kwargs: lambda: message(**kwargs),
+            attachments=lambda: SimpleNamespace(get=lambda **kwargs: lambda: {'data': kwargs['id']}))
+        gmail_service.service = SimpleNamespace(
+            users=lambda: SimpleNamespace(messages=lambda: messages_api),
+            new_batch_http_request=_Batch)
+        
+        message_ids = [f'msg{i}' for i in range(150)]
+        result = gmail_service.get_messages_with_attachments_batch(message_ids)
+        
+        # Two chunks of messages, then two chunks of attachments
+        self.assertEqual([len(batch.requests) for batch in batches], [100, 50, 100, 50])
+        self.assertEqual([m['subject'] for m in result], message_ids)
+        self.assertEqual(result[0]['attachments'][0]['data'], 'att-msg0')
+    
+    def test_get_messages_with_attachments_batch_failures(self):
+        """Test a dropped batch connection falls back, and messages with a failed attachment are skipped."""
+        gmail_service = GmailService.__new__(GmailService)  # Create without __init__
+        gmail_service.creds = None
+        
+        def message(**kwargs):
+            return {'payload': {
+                'headers': [{'name': 'Subject', 'value': kwargs['id']}],
+                'parts': [{'filename': 'leads.csv', 'mimeType': 'text/csv',
+                           'body': {'attachmentId': f"att-{kwargs['id']}"}}]
+            }}
+        
+        class _Batch:
+            """Batch stand-in whose message batch times out and whose first attachment fails."""
+            def __init__(self, callback):
+                self.callback = callback
+                self.requests = []
+            
+            def add(self, request, request_id):
+                self.requests.append((request_id, request))
+            
+            def execute(self):
+                if ':' not in self.requests[0][0]:
+                    raise TimeoutError('timed out')
+                for request_id, request in self.requests:
+                    if request_id.startswith('msg0:'):
+                        self.callback(request_id, None, HttpError(Mock(status=500), b'Backend error'))
+                    else:
+                        self.callback(request_id, request.execute(), None)
+        
+        def request(response):
+            return SimpleNamespace(execute=lambda **_: response)
+        
+        messages_api = SimpleNamespace(
+            get=lambda **kwargs: request(message(**kwargs)),
+            attachments=lambda: SimpleNamespace(get=lambda **kwargs: request({'data': kwargs['id']})))
+        gmail_service.service = SimpleNamespace(
+            users=lambda: SimpleNamespace(messages=lambda: messages_api),
+            new_batch_http_request=_Batch)
+        
+        result = gmail_service.get_messages_with_attachments_batch(['msg0', 'msg1'])
+        
+        self.assertEqual([m['subject'] for m in result], ['msg1'])
+        self.assertEqual(result[0]['attachments'][0]['data'], 'att-msg1')
+    
     def test_download_attachment(self):
         """Test attachment download functionality."""
         gmail_service = GmailService.__new__(GmailService)  # Create without __init__
         
-        # Test data
-        test_data = b"test,csv,data"
-        encoded_data = base64.urlsafe_b64encode(test_data).decode()
-        
-        result = gmail_service.download_attachment(encoded_data)
-        self.assertEqual(result, test_data)
+        result = gmail_service.download_attachment(_ENCODED_ATTACHMENT)
+        self.assertEqual(result, _ATTACHMENT_DATA)
 
 
 class TestGoogleDriveService(unittest.TestCase):
     """Test cases for Google Drive service."""
     
+    @classmethod
+    def setUpClass(cls):
+        """Build the fixed API response once; it is never modified."""
+        cls._response_mock = {'id': 'file123'}
+    
     def setUp(self):
         """Set up test fixtures."""
         self.mock_credentials_file = 'test_credentials.json'
         self.mock_token_file = 'test_drive_token.json'
+        # Fresh mocks per test, as in TestGmailService
+        self._creds_mock = Mock(valid=True)
+        self._service_mock = Mock()
     
     @patch('google_drive_service.build')
-    @patch('google_drive_service.pickle.load')
-    @patch('google_drive_service.os.path.exists')
-    @patch('builtins.open', create=True)
-    def test_upload_file_success(self, mock_open, mock_exists, mock_pickle_load, mock_build):
+    @patch('google_drive_service.get_creds')
+    def test_upload_file_success(self, mock_get_creds, mock_build):
         """Test successful file upload."""
         # Setup mocks
-        mock_exists.return_value = True
-        mock_creds = Mock()
-        mock_creds.valid = True
-        mock_pickle_load.return_value = mock_creds
+        mock_get_creds.return_value = self._creds_mock
         
-        mock_service = Mock()
+        mock_service = self._service_mock
         mock_build.return_value = mock_service
         
         # Mock upload response
-        mock_response = {'id': 'file123'}
-        mock_service.files().create().execute.return_value = mock_response
+        mock_service.files().create().execute.return_value = self._response_mock
         
         drive_service = GoogleDriveService(self.mock_credentials_file, self.mock_token_file)
         
@@ -125,6 +257,115 @@ class TestGoogleDriveService(unittest.TestCase):
         
         self.assertEqual(result, 'file123')
     
+    def test_share_batch(self):
+        """Test sharing is batched and grants the batch dropped are retried."""
+        drive_service = GoogleDriveService.__new__(GoogleDriveService)  # Create without __init__
+        granted = {}
+        direct_creates = []
+        batches = []
+        
+        def create(fileId, body, fields):
+            email = body['emailAddress']
+            def execute():
+                direct_creates.append(email)
+                granted[email] = f'perm-{email}'
+                return {'id': granted[email]}
+            return SimpleNamespace(email=email, execute=execute)
+        
+        class _Batch:
+            """Batch stand-in where, like concurrent Drive edits, only the last grant sticks."""
+            def __init__(self, callback):
+                self.requests = []
+                batches.append(self)
+            
+            def add(self, request, request_id):
+                self.requests.append(request)
+            
+            def execute(self):
+                last = self.requests[-1].email
+                granted[last] = f'perm-{last}'
+        
+        permissions_api = SimpleNamespace(
+            create=create,
+            list=lambda **_: SimpleNamespace(execute=lambda: {
+                'permissions': [{'id': pid, 'emailAddress': email} for email, pid in granted.items()]
+            }))
+        drive_service.service = SimpleNamespace(
+            permissions=lambda: permissions_api,
+            new_batch_http_request=_Batch)
+        
+        emails = ['a@example.com', 'b@example.com', 'c@example.com']
+        result = drive_service.share_batch('file123', emails)
+        
+        self.assertEqual([len(batch.requests) for batch in batches], [3])
+        self.assertEqual(direct_creates, ['a@example.com', 'b@example.com'])
+        self.assertEqual(result, {email: f'perm-{email}' for email in emails})
+    
+    def test_share_batch_list_failure_not_reshared(self):
+        """Test that grants are not re-created, re-sending notifications, when they can't be confirmed."""
+        drive_service = GoogleDriveService.__new__(GoogleDriveService)  # Create without __init__
+        direct_creates = []
+        
+        class _Batch:
+            """Batch stand-in that reports every grant as created."""
+            def __init__(self, callback):
+                self.callback = callback
+                self.request_ids = []
+            
+            def add(self, request, request_id):
+                self.request_ids.append(request_id)
+            
+            def execute(self):
+                for request_id in self.request_ids:
+                    self.callback(request_id, {'id': f'perm-{request_id}'}, None)
+        
+        def list_permissions(**_):
+            raise HttpError(Mock(status=500), b'Backend error')
+        
+        permissions_api = SimpleNamespace(
+            create=lambda **kwargs: SimpleNamespace(execute=lambda: direct_creates.append(kwargs)),
+            list=lambda **_: SimpleNamespace(execute=list_permissions))
+        drive_service.service = SimpleNamespace(
+            permissions=lambda: permissions_api,
+            new_batch_http_request=_Batch)
+        
+        emails = ['a@example.com', 'b@example.com']
+        result = drive_service.share_batch('file123', emails)
+        
+        self.assertEqual(direct_creates, [])
+        self.assertEqual(result, {email: f'perm-{email}' for email in emails})
+    
+    def test_share_batch_transport_error_confirmed_by_list(self):
+        """Test that a dropped batch connection falls through to the permissions list check."""
+        drive_service = GoogleDriveService.__new__(GoogleDriveService)  # Create without __init__
+        direct_creates = []
+        
+        class _Batch:
+            """Batch stand-in whose first grant lands before the connection drops."""
+            def __init__(self, callback):
+                pass
+            
+            def add(self, request, request_id):
+                pass
+            
+            def execute(self):
+                raise TimeoutError('timed out')
+        
+        permissions_api = SimpleNamespace(
+            create=lambda **kwargs: SimpleNamespace(execute=lambda: (
+                direct_creates.append(kwargs['body']['emailAddress']) or {'id': 'perm-b'})),
+            list=lambda **_: SimpleNamespace(execute=lambda: {
+                'permissions': [{'id': 'perm-a', 'emailAddress': 'a@example.com'}]
+            }))
+        drive_service.service = SimpleNamespace(
+            permissions=lambda: permissions_api,
+            new_batch_http_request=_Batch)
+        
+        result = drive_service.share_batch('file123', ['a@example.com', 'b@example.com'])
+        
+        self.assertEqual(direct_creates, ['b@example.com'])
+        self.assertEqual(result, {'a@example.com': 'perm-a', 'b@example.com': 'perm-b'})
+    
     def test_create_timestamped_filename(self):
         """Test timestamped filename creation."""
         drive_service = GoogleDriveService.__new__(GoogleDriveService)  # Create without __init__
@@ -137,33 +378,102 @@ class TestGoogleDriveService(unittest.TestCase):
         self.assertEqual(len(filename), len('test_file_2023-12-25_14-30-45.csv'))
 
 
+class TestGetCreds(unittest.TestCase):
+    """Test cases for the shared credential loader."""
+    
+    @patch.dict('_auth._CREDS_CACHE', clear=True)
+    @patch('_auth.Credentials.from_authorized_user_info')
+    @patch('builtins.open', mock_open(read_data=b'{}'))
+    def test_token_read_once(self, mock_from_info):
+        """Test that services sharing a token file only load it once."""
+        mock_from_info.return_value = Mock(valid=True)
+        
+        first = get_creds('test_token.json')
+        second = get_creds('test_token.json')
+        
+        self.assertIs(first, second)
+        mock_from_info.assert_called_once()
+    
+    @patch.dict('_auth._CREDS_CACHE', clear=True)
+    @patch('_auth.Credentials.from_authorized_user_info')
+    def test_expired_cached_token_refreshed(self, mock_from_info):
+        """Test that an expired cached token is refreshed and replaced on disk without reloading it."""
+        creds = Mock(valid=False, expired=True, refresh_token='refresh')
+        creds.to_json.return_value = '{"token": "refreshed"}'
+        
+        with tempfile.TemporaryDirectory() as token_dir:
+            token_file = os.path.join(token_dir, 'token.json')
+            _auth._CREDS_CACHE[token_file] = creds
+            
+            self.assertIs(get_creds(token_file), creds)
+            
+            with open(token_file) as token:
+                self.assertEqual(token.read(), '{"token": "refreshed"}')
+            self.assertEqual(os.listdir(token_dir), ['token.json'])
+        
+        creds.refresh.assert_called_once()
+        mock_from_info.assert_not_called()
+    
+    @patch.dict('_auth._CREDS_CACHE', clear=True)
+    def test_incomplete_json_token_not_unpickled(self):
+        """Test that a JSON token missing fields reports that, rather than a pickle error."""
+        with tempfile.TemporaryDirectory() as token_dir:
+            token_file = os.path.join(token_dir, 'token.json')
+            with open(token_file, 'w') as token:
+                token.write('{"token": "access-token"}')
+            
+            with self.assertRaisesRegex(ValueError, 'refresh_token'):
+                get_creds(token_file)
+    
+    @patch.dict('_auth._CREDS_CACHE', clear=True)
+    def test_token_missing_scopes_rejected(self):
+        """Test that a Gmail-only token fails fast for a service needing Drive scopes."""
+        creds = Mock(valid=True, scopes=['https://www.googleapis.com/auth/gmail.readonly'])
+        _auth._CREDS_CACHE['token.json'] = creds
+        
+        with self.assertRaisesRegex(Exception, 'manual_auth.py'):
+            get_creds('token.json', ['https://www.googleapis.com/auth/drive.file'])
+        self.assertIs(get_creds('token.json', creds.scopes), creds)
+
+
 class TestCSVProcessor(unittest.TestCase):
     """Test cases for CSV processor."""
     
-    def setUp(self):
-        """Set up test fixtures."""
-        self.processor = CSVProcessor(max_rows=100)
+    @classmethod
+    def setUpClass(cls):
+        """Set up test fixtures once; the processor keeps no per-call state."""
+        cls._processor = CSVProcessor(max_rows=100)
     
     def test_process_csv_attachment(self):
         """Test CSV processing functionality."""
-        # Create test CSV data
-        test_csv = """LeadCreationDate,InquiryDate,CommunityName,Classification,TotalLeads,SubSourceName,SourceName
-2023-12-01,2023-12-01,Test Community,Hot Lead,1,Online,Website
-2023-12-02,2023-12-02,Another Community,Warm Lead,2,Referral,Agent"""
-        
-        csv_data = test_csv.encode('utf-8')
-        result = self.processor.process_csv_attachment(csv_data)
+        result = self._processor.process_csv_attachment(_CSV_BYTES)
         
         self.assertEqual(len(result), 2)
         self.assertEqual(result[0]['LeadCreationDate'], '2023-12-01')
         self.assertEqual(result[0]['CommunityName'], 'Test Community')
         self.assertEqual(result[1]['TotalLeads'], '2')
     
+    def test_process_csv_attachment_carriage_return_in_field(self):
+        """Test that a carriage return inside a field is dropped instead of splitting the row."""
+        csv_bytes = TEST_CSV.replace('Another Community', '"Another Comm\runity"').encode('utf-8')
+        
+        result = self._processor.process_csv_attachment(csv_bytes)
+        
+        self.assertEqual(len(result), 2)
+        self.assertEqual(result[1]['CommunityName'], 'Another Community')
+        self.assertEqual(result[1]['SourceName'], 'Agent')
+    
+    def test_process_csv_attachment_single_line(self):
+        """Test that a single line with no line break is processed as a data row."""
+        result = self._processor.process_csv_attachment(TEST_CSV.splitlines()[1].encode('utf-8'))
+        
+        self.assertEqual([row['CommunityName'] for row in result], ['Test Community'])
+    
     def test_process_csv_row(self):
         """Test individual row processing."""
         test_row = '"2023-12-01","2023-12-01","Test Community","Hot Lead","1","Online","Website"'
         
-        result = self.processor._process_csv_row(test_row)
+        result = self._processor._process_csv_row(test_row)
         
         expected = {
             'LeadCreationDate': '2023-12-01',
@@ -191,18 +501,16 @@ class TestCSVProcessor(unittest.TestCase):
             }
         ]
         
-        result = self.processor.create_output_csv(test_data)
+        result = self._processor.create_output_csv(test_data)
         
-        # Decode and check content
-        csv_content = result.decode('utf-8')
-        self.assertIn('LeadCreationDate', csv_content)
-        self.assertIn('Test Community', csv_content)
-        self.assertIn('Hot Lead', csv_content)
+        # Check content
+        for fragment in _OUTPUT_EXPECTED_FRAGMENTS:
+            self.assertIn(fragment, result)
     
     def test_generate_filenames(self):
         """Test filename generation."""
-        temp_filename = self.processor.generate_temp_filename('original.csv')
-        output_filename = self.processor.generate_output_filename()
+        temp_filename = self._processor.generate_temp_filename('original.csv')
+        output_filename = self._processor.generate_output_filename()
         
         self.assertTrue(temp_filename.startswith('New Leads - Daily TMP'))
         self.assertTrue(temp_filename.endswith('.csv'))
@@ -211,131 +519,154 @@ class TestCSVProcessor(unittest.TestCase):
         self.assertTrue(output_filename.endswith('.csv'))
 
 
+class _ServiceStub:
+    """Lightweight stand-in for a service class that counts its constructions."""
+    instances = 0
+    
+    def __init__(self, *args, **kwargs):
+        type(self).instances += 1
+
+
+class _GmailStub(_ServiceStub):
+    """Gmail service stand-in whose searches find no messages."""
+    instances = 0
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.creds = None
+        self.search_calls = 0
+    
+    def search_emails(self, **kwargs):
+        self.search_calls += 1
+        return []
+
+
+class _DriveStub(_ServiceStub):
+    """Google Drive service stand-in."""
+    instances = 0
+
+
+class _SheetsStub(_ServiceStub):
+    """Google Sheets service stand-in."""
+    instances = 0
+
+
+class _CSVStub(_ServiceStub):
+    """CSV processor stand-in."""
+    instances = 0
+
+
 class TestEmailProcessor(unittest.TestCase):
     """Test cases for main email processor."""
     
+    @classmethod
+    def setUpClass(cls):
+        """Set up service patches shared by every test."""
+        # Replace the services with plain stubs once for the whole class
+        cls._stubs = (_GmailStub, _DriveStub, _SheetsStub, _CSVStub)
+        cls._start_patch('email_processor.GmailService', _GmailStub)
+        cls._start_patch('email_processor.GoogleDriveService', _DriveStub)
+        cls._start_patch('email_processor.GoogleSheetsService', _SheetsStub)
+        cls._start_patch('email_processor.CSVProcessor', _CSVStub)
+    
+    @classmethod
+    def _start_patch(cls, target, new):
+        """Start a patch that stays active until the class is torn down."""
+        patcher = patch(target, new)
+        cls.addClassCleanup(patcher.stop)
+        patcher.start()
+    
     def setUp(self):
-        """Set up test fixtures."""
-        # Create temporary environment variables
-        self.env_vars = {
-            'GMAIL_CREDENTIALS_FILE': 'test_credentials.json',
-            'GMAIL_TOKEN_FILE': 'test_token.json',
-            'GMAIL_FROM_EMAIL': 'test@example.com',
-            'GMAIL_SUBJECT_FILTER': 'Test',
-            'GMAIL_LABEL': 'INBOX',
-            'GOOGLE_DRIVE_CREDENTIALS_FILE': 'test_credentials.json',
-            'CHECK_INTERVAL_MINUTES': '5',
-            'MAX_ROWS_TO_PROCESS': '100',
-            'LOG_LEVEL': 'INFO',
-            'LOG_FILE': 'test.log'
-        }
+        """Clear constructions recorded by previous tests on the shared stubs."""
+        for stub in self._stubs:
+            stub.instances = 0
     
-    @patch.dict(os.environ, {})
-    @patch('email_processor.GmailService')
-    @patch('email_processor.GoogleDriveService')
-    @patch('email_processor.CSVProcessor')
-    def test_email_processor_initialization(self, mock_csv, mock_drive, mock_gmail):
+    def test_email_processor_initialization(self):
         """Test email processor initialization."""
-        # Set environment variables
-        for key, value in self.env_vars.items():
-            os.environ[key] = value
-        
         processor = EmailProcessor()
         
         # Verify services were initialized
-        mock_gmail.assert_called_once()
-        mock_drive.assert_called_once()
-        mock_csv.assert_called_once()
-    
-    @patch.dict(os.environ, {})
-    @patch('email_processor.GmailService')
-    @patch('email_processor.GoogleDriveService')
-    @patch('email_processor.CSVProcessor')
-    def test_process_emails_no_messages(self, mock_csv, mock_drive, mock_gmail):
+        self.assertEqual(_GmailStub.instances, 1)
+        self.assertEqual(_DriveStub.instances, 1)
+        self.assertEqual(_CSVStub.instances, 1)
+    
+    def test_process_emails_no_messages(self):
         """Test processing when no emails are found."""
-        # Set environment variables
-        for key, value in self.env_vars.items():
-            os.environ[key] = value
-        
-        # Mock Gmail service to return no messages
-        mock_gmail_instance = Mock()
-        mock_gmail_instance.search_emails.return_value = []
-        mock_gmail.return_value = mock_gmail_instance
-        
+        # The Gmail stub's searches return no messages
         processor = EmailProcessor()
         processor.process_emails()
         
         # Verify search was called but no processing occurred
-        mock_gmail_instance.search_emails.assert_called_once()
+        self.assertEqual(processor.gmail_service.search_calls, 1)
 
 
 class TestIntegration(unittest.TestCase):
     """Integration tests for the complete workflow."""
     
+    @classmethod
+    def setUpClass(cls):
+        """Set up test fixtures once; the processor keeps no per-call state."""
+        cls._processor = CSVProcessor(max_rows=100)
+    
     def test_end_to_end_csv_processing(self):
         """Test complete CSV processing workflow."""
-        # Create test CSV data
-        test_csv = """LeadCreationDate,InquiryDate,CommunityName,Classification,TotalLeads,SubSourceName,SourceName
-2023-12-01,2023-12-01,Test Community,Hot Lead,1,Online,Website
-2023-12-02,2023-12-02,Another Community,Warm Lead,2,Referral,Agent"""
-        
-        processor = CSVProcessor()
-        
         # Process the CSV
-        csv_data = test_csv.encode('utf-8')
-        processed_rows = processor.process_csv_attachment(csv_data)
+        processed_rows = self._processor.process_csv_attachment(_CSV_BYTES)
         
         # Create output CSV
-        output_csv = processor.create_output_csv(processed_rows)
+        output_csv = self._processor.create_output_csv(processed_rows)
         
         # Verify the complete workflow
         self.assertEqual(len(processed_rows), 2)
         self.assertGreater(len(output_csv), 0)
         
         # Verify output contains expected data
-        output_text = output_csv.decode('utf-8')
-        self.assertIn('LeadCreationDate', output_text)
-        self.assertIn('Test Community', output_text)
-
-
-def create_test_credentials():
-    """Create mock credentials file for testing."""
-    mock_credentials = {
-        "installed": {
-            "client_id": "test_client_id",
-            "project_id": "test_project",
-            "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-            "token_uri": "https://oauth2.googleapis.com/token",
-            "client_secret": "test_secret",
-            "redirect_uris": ["http://localhost"]
-        }
-    }
-    
-    with open('test_credentials.json', 'w') as f:
-        json.dump(mock_credentials, f)
-
-
-def cleanup_test_files():
-    """Clean up test files."""
-    test_files = [
-        'test_credentials.json',
-        'test_token.json',
-        'test_drive_token.json',
-        'test.log'
-    ]
+        for fragment in _OUTPUT_EXPECTED_FRAGMENTS:
+            self.assertIn(fragment, output_csv)
     
-    for file in test_files:
-        if os.path.exists(file):
-            os.remove(file)
+    def test_end_to_end_streaming(self):
+        """Test streaming CSV workflow keeps memory flat as rows grow."""
+        # Streamed output matches the in-memory workflow
+        output = BytesIO()
+        row_count = self._processor.create_output_csv_stream(
+            self._processor.stream_csv_attachment(BytesIO(_CSV_BYTES)), output)
+        
+        self.assertEqual(row_count, 2)
+        self.assertEqual(output.getvalue(), self._processor.create_output_csv(
+            self._processor.process_csv_attachment(_CSV_BYTES)))
+        
+        class _CountingSink(RawIOBase):
+            """Writable stream that only counts bytes, so output size isn't measured."""
+            size = 0
+            
+            def writable(self):
+                return True
+            
+            def write(self, data):
+                self.size += len(data)
+                return len(data)
+        
+        row = b'2023-12-01,2023-12-01,Test Community,Hot Lead,1,Online,Website,12345\r\n'
+        peaks = []
+        for rows in (1000, 20000):
+            source = BytesIO(_CSV_BYTES.split(b'\n', 1)[0] + b'\n' + row * rows)
+            sink = _CountingSink()
+            
+            tracemalloc.start()
+            try:
+                row_count = self._processor.create_output_csv_stream(
+                    self._processor.stream_csv_attachment(source), sink)
+                peaks.append(tracemalloc.get_traced_memory()[1])
+            finally:
+                tracemalloc.stop()
+            
+            self.assertEqual(row_count, rows)
+            self.assertGreater(sink.size, 0)
+        
+        # Peak memory stays bounded regardless of row count
+        for peak in peaks:
+            self.assertLess(peak, 512 * 1024)
 
 
 if __name__ == '__main__':
-    # Create test credentials
-    create_test_credentials()
-    
-    try:
-        # Run tests
-        unittest.main(verbosity=2)
-    finally:
-        # Clean up
-        cleanup_test_files()
+    unittest.main(verbosity=2)
@@ -0,0 +1,169 @@
+"""
+Unit tests for the manual OAuth authentication script.
+"""
+
+import os
+import json
+import time
+import pickle
+import threading
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+from google.oauth2.credentials import Credentials
+
+import pytest
+
+import manual_auth
+from manual_auth import ALL_SCOPES, GMAIL_SCOPES, REFRESH_WINDOW_SECONDS, authenticate_service
+
+
+def _write_token(path, scopes):
+    """Write a JSON token granted the given scopes, valid for another hour."""
+    path.write_text(json.dumps({
+        'token': 'access-token',
+        'expiry': (datetime.utcnow() + timedelta(hours=1)).isoformat() + 'Z',
+        'refresh_token': 'refresh-token',
+        'client_id': 'client-id',
+        'client_secret': 'client-secret',
+        'scopes': list(scopes)
+    }))
+    return str(path)
+
+
+@pytest.fixture
+def interactive_auth():
+    """Replace the interactive OAuth methods with one that returns fresh credentials."""
+    new_creds = MagicMock(valid=True, scopes=list(ALL_SCOPES))
+    run_method = MagicMock(return_value=new_creds)
+    with patch.dict(manual_auth._CREDS_CACHE, clear=True), \
+         patch.dict(manual_auth._DIRTY, clear=True), \
+         patch.object(manual_auth, '_AUTH_METHODS', (('Test', 'test authentication', run_method),)), \
+         patch('google_auth_oauthlib.flow.InstalledAppFlow.from_client_config'):
+        yield run_method
+
+
+def test_token_missing_scopes_reauthenticates(tmp_path, interactive_auth):
+    """Test that a Gmail-only token is not accepted for the combined scopes."""
+    token_file = _write_token(tmp_path / 'token.json', GMAIL_SCOPES)
+    
+    assert authenticate_service('Google', ALL_SCOPES, token_file, {})
+    
+    interactive_auth.assert_called_once()
+    assert manual_auth._DIRTY[token_file] is interactive_auth.return_value
+
+
+def test_token_with_all_scopes_reused(tmp_path, interactive_auth):
+    """Test that a token granted every scope is used without prompting."""
+    token_file = _write_token(tmp_path / 'token.json', ALL_SCOPES)
+    
+    assert authenticate_service('Google', ALL_SCOPES, token_file, {})
+    
+    interactive_auth.assert_not_called()
+    assert set(manual_auth._CREDS_CACHE[token_file].scopes) == set(ALL_SCOPES)
+
+
+class _CountingLock:
+    """Lock that counts how many times it has been entered."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.entered = 0
+    
+    def __enter__(self):
+        self._lock.acquire()
+        self.entered += 1
+        return self
+    
+    def __exit__(self, *exc_info):
+        self._lock.release()
+
+
+def test_concurrent_refreshes_share_one_request():
+    """Test that callers arriving during a refresh wait for it instead of refreshing again."""
+    started = threading.Event()
+    release = threading.Event()
+    
+    def refresh(request):
+        started.set()
+        release.wait(5)
+    
+    creds = MagicMock()
+    creds.refresh.side_effect = refresh
+    lock = _CountingLock()
+    results = []
+    
+    with patch.object(manual_auth, '_refresh_lock', lock), \
+         patch.object(manual_auth, '_get_request'), \
+         patch.dict(manual_auth._refresh_inflight, clear=True):
+        threads = [threading.Thread(target=lambda: results.append(
+            manual_auth._refresh_credentials(creds, 'token.json'))) for _ in range(4)]
+        threads[0].start()
+        assert started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        
+        # Every waiter has checked for the in-flight refresh once it has taken the lock
+        deadline = time.monotonic() + 5
+        while lock.entered < len(threads) and time.monotonic() < deadline:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+    
+    creds.refresh.assert_called_once()
+    assert results == [creds] * len(threads)
+
+
+def test_flush_dirty_replaces_token_with_json(tmp_path):
+    """Test that queued tokens are written as JSON through an atomic rename."""
+    token_file = str(tmp_path / 'token.json')
+    creds = MagicMock()
+    creds.to_json.return_value = '{"token": "access-token"}'
+    
+    with patch.dict(manual_auth._DIRTY, {token_file: creds}, clear=True), \
+         patch('_auth.os.replace', wraps=os.replace) as mock_replace:
+        manual_auth._flush_dirty()
+        assert manual_auth._DIRTY == {}
+    
+    mock_replace.assert_called_once_with(token_file + '.tmp', token_file)
+    assert json.loads((tmp_path / 'token.json').read_text()) == {'token': 'access-token'}
+    assert os.listdir(tmp_path) == ['token.json']
+
+
+def test_legacy_pickled_token_rewritten_as_json(tmp_path, interactive_auth):
+    """Test that a valid pickled token is accepted and migrated to JSON."""
+    token_file = tmp_path / 'token.json'
+    token_file.write_bytes(pickle.dumps(Credentials(
+        token='access-token',
+        refresh_token='refresh-token',
+        token_uri='https://oauth2.googleapis.com/token',
+        client_id='client-id',
+        client_secret='client-secret',
+        scopes=list(ALL_SCOPES),
+        expiry=datetime.utcnow() + timedelta(hours=1)
+    )))
+    
+    assert authenticate_service('Google', ALL_SCOPES, str(token_file), {})
+    manual_auth._flush_dirty()
+    
+    interactive_auth.assert_not_called()
+    token = json.loads(token_file.read_text())
+    assert token['token'] == 'access-token'
+    assert set(token['scopes']) == set(ALL_SCOPES)
+
+
+@pytest.mark.parametrize('seconds_left,refreshed', [
+    (REFRESH_WINDOW_SECONDS // 2, True),
+    (REFRESH_WINDOW_SECONDS * 10, False),
+])
+def test_refresh_if_expiring(seconds_left, refreshed):
+    """Test that only tokens expiring within the refresh window are refreshed early."""
+    creds = MagicMock(refresh_token='refresh-token', expiry=datetime.utcnow() + timedelta(seconds=seconds_left))
+    
+    with patch.object(manual_auth, '_refresh_credentials', return_value=creds) as mock_refresh, \
+         patch.dict(manual_auth._DIRTY, clear=True):
+        assert manual_auth._refresh_if_expiring('Google', creds, 'token.json') is creds
+        assert ('token.json' in manual_auth._DIRTY) == refreshed
+    
+    assert mock_refresh.called == refreshed
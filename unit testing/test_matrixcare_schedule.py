@@ -1,276 +1,219 @@
 """
 Unit tests for MatrixCare Looker Dashboard automation scheduling.
 
-This test verifies that the program correctly identifies target Tuesdays 
-and processes emails at the right times.
+These tests pin the current time and verify that the program processes
+the day's emails.
 """
 
 import unittest
-from unittest.mock import Mock, patch, MagicMock
-from datetime import datetime, date
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict
+from unittest.mock import Mock, patch, DEFAULT
+from datetime import datetime, time
 import sys
 import os
+import logging
+
+import pytest
 
 # Add parent directory to path to import our modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from email_processor import EmailProcessor
 
+# Environment variables read by EmailProcessor, set once for the whole module
+_ENV = {
+    'GMAIL_CREDENTIALS_FILE': 'test_credentials.json',
+    'GMAIL_TOKEN_FILE': 'test_token.json',
+    'GMAIL_FROM_EMAIL': 'test@example.com',
+    'GMAIL_SUBJECT_FILTER': 'MatrixCare Automation for Looker Dash',
+    'GOOGLE_DRIVE_FOLDER_ID': '1xrzn2LZ-URdb1nx_7MspHyytq6LVk1iq',
+    'GOOGLE_SHEETS_SPREADSHEET_ID': 'test_spreadsheet_id',
+    'LOG_LEVEL': 'DEBUG'
+}
+_saved_env = {}
+
+
+def setUpModule():
+    """Set the test environment once for every test in the module."""
+    _saved_env.update({key: os.environ.get(key) for key in _ENV})
+    os.environ.update(_ENV)
+
+
+def tearDownModule():
+    """Restore the original environment."""
+    for key, value in _saved_env.items():
+        if value is None:
+            os.environ.pop(key, None)
+        else:
+            os.environ[key] = value
+
+
+@contextmanager
+def _freeze(frozen_date, frozen_time=time(0, 0)):
+    """Patch email_processor.datetime so now() returns a fixed date and time."""
+    frozen_now = datetime.combine(frozen_date, frozen_time)
+    
+    class _FrozenDatetime(datetime):
+        """Real datetime class whose now() is pinned to frozen_now."""
+        @classmethod
+        def now(cls, tz=None):
+            return frozen_now
+    
+    with patch('email_processor.datetime', _FrozenDatetime):
+        yield frozen_now
+
+
+@dataclass(frozen=True)
+class _FixtureMocks:
+    """Canned email and simulated time shared by the workflow tests."""
+    message: Dict[str, str]
+    target_time: datetime
+
+
+# Header row the mocked CSV processor hands to the Sheets service
+_SHEET_HEADERS = ['LeadCreationDate', 'InquiryDate', 'CommunityName', 'Classification', 'TotalLeads', 'SubSourceName', 'SourceName', 'LeadID']
+
+
+@lru_cache(maxsize=None)
+def _build_fixture_mocks() -> _FixtureMocks:
+    """Build the shared workflow fixtures once for the module."""
+    return _FixtureMocks(
+        message={
+            'from': 'automation@matrixcare.com',
+            'subject': 'MatrixCare Automation for Looker Dash',
+            'body': 'Dashboard data for October 8, 2025\n\nKey metrics:\n- Total patients: 1,234\n- Active cases: 567\n- Completed assessments: 890'
+        },
+        # Tuesday, September 30, 2025 at 11:20 AM
+        target_time=datetime(2025, 9, 30, 11, 20, 0)
+    )
+
 
 class TestMatrixCareSchedule(unittest.TestCase):
     """Test the MatrixCare scheduling functionality."""
     
     def setUp(self):
         """Set up test fixtures."""
-        # Mock environment variables
-        with patch.dict(os.environ, {
-            'GMAIL_CREDENTIALS_FILE': 'test_credentials.json',
-            'GMAIL_TOKEN_FILE': 'test_token.json',
-            'GMAIL_FROM_EMAIL': 'test@example.com',
-            'GMAIL_SUBJECT_FILTER': 'MatrixCare Automation for Looker Dash',
-            'GOOGLE_DRIVE_FOLDER_ID': '1xrzn2LZ-URdb1nx_7MspHyytq6LVk1iq',
-            'GOOGLE_SHEETS_SPREADSHEET_ID': 'test_spreadsheet_id',
-            'LOG_LEVEL': 'DEBUG'
-        }):
-            # Mock the service initializations
-            with patch('email_processor.GmailService'), \
-                 patch('email_processor.GoogleDriveService'), \
-                 patch('email_processor.GoogleSheetsService'), \
-                 patch('email_processor.CSVProcessor'):
-                
-                self.processor = EmailProcessor()
-    
-    def test_is_target_tuesday_correct_day(self):
-        """Test that is_target_tuesday correctly identifies target Tuesdays."""
-        # Mock the reference Tuesday (September 30, 2025) - this should be a target (week 0)
-        target_tuesday = date(2025, 9, 30)
-        
-        with patch('email_processor.datetime') as mock_datetime:
-            mock_now = Mock()
-            mock_now.date.return_value = target_tuesday
-            mock_datetime.now.return_value = mock_now
-            
-            result = self.processor.is_target_tuesday()
-            self.assertTrue(result, "September 30, 2025 should be a target Tuesday (first target)")
-    
-    def test_is_target_tuesday_wrong_day(self):
-        """Test that is_target_tuesday rejects non-Tuesdays."""
-        # Mock a Wednesday
-        wednesday = date(2025, 10, 9)
-        
-        with patch('email_processor.datetime') as mock_datetime:
-            mock_now = Mock()
-            mock_now.date.return_value = wednesday
-            mock_datetime.now.return_value = mock_now
-            
-            result = self.processor.is_target_tuesday()
-            self.assertFalse(result, "Wednesday should not be a target day")
-    
-    def test_is_target_tuesday_off_week(self):
-        """Test that is_target_tuesday rejects off-week Tuesdays."""
-        # Mock a Tuesday that should NOT be a target (odd week difference from reference)
-        # Reference is 2025-09-30, so 2025-10-07 should NOT be a target (1 week later, odd)
-        off_tuesday = date(2025, 10, 7)
-        
-        with patch('email_processor.datetime') as mock_datetime:
-            mock_now = Mock()
-            mock_now.date.return_value = off_tuesday
-            mock_datetime.now.return_value = mock_now
-            
-            result = self.processor.is_target_tuesday()
-            self.assertFalse(result, "October 7, 2025 should not be a target Tuesday (off week)")
-    
-    def test_is_target_tuesday_second_target(self):
-        """Test that is_target_tuesday correctly identifies the second target Tuesday."""
-        # Mock the second target Tuesday (October 14, 2025) - this should be a target (week 2)
-        second_target = date(2025, 10, 14)
-        
-        with patch('email_processor.datetime') as mock_datetime:
-            mock_now = Mock()
-            mock_now.date.return_value = second_target
-            mock_datetime.now.return_value = mock_now
-            
-            result = self.processor.is_target_tuesday()
-            self.assertTrue(result, "October 14, 2025 should be a target Tuesday (second target)")
-    
-    def test_should_check_emails_at_1120(self):
-        """Test that should_check_emails returns True at 11:20 AM on target Tuesday."""
-        target_tuesday = date(2025, 9, 30)  # First target Tuesday
-        target_time = datetime(2025, 9, 30, 11, 20, 0)  # 11:20 AM
-        
-        with patch('email_processor.datetime') as mock_datetime:
-            mock_now = Mock()
-            mock_now.date.return_value = target_tuesday
-            mock_now.time.return_value = target_time.time()
-            mock_datetime.now.return_value = mock_now
-            
-            result = self.processor.should_check_emails()
-            self.assertTrue(result, "Should check emails at 11:20 AM on target Tuesday")
-    
-    def test_should_check_emails_at_1200(self):
-        """Test that should_check_emails returns True at 12:00 PM on target Tuesday."""
-        target_tuesday = date(2025, 9, 30)  # First target Tuesday
-        target_time = datetime(2025, 9, 30, 12, 0, 0)  # 12:00 PM
-        
-        with patch('email_processor.datetime') as mock_datetime:
-            mock_now = Mock()
-            mock_now.date.return_value = target_tuesday
-            mock_now.time.return_value = target_time.time()
-            mock_datetime.now.return_value = mock_now
-            
-            result = self.processor.should_check_emails()
-            self.assertTrue(result, "Should check emails at 12:00 PM on target Tuesday")
-    
-    def test_should_check_emails_wrong_time(self):
-        """Test that should_check_emails returns False at wrong time."""
-        target_tuesday = date(2025, 9, 30)  # First target Tuesday
-        wrong_time = datetime(2025, 9, 30, 10, 30, 0)  # 10:30 AM
-        
-        with patch('email_processor.datetime') as mock_datetime:
-            mock_now = Mock()
-            mock_now.date.return_value = target_tuesday
-            mock_now.time.return_value = wrong_time.time()
-            mock_datetime.now.return_value = mock_now
-            
-            result = self.processor.should_check_emails()
-            self.assertFalse(result, "Should not check emails at 10:30 AM")
+        # Mock the service initializations
+        with patch.multiple('email_processor',
+                            GmailService=DEFAULT,
+                            GoogleDriveService=DEFAULT,
+                            GoogleSheetsService=DEFAULT,
+                            CSVProcessor=DEFAULT):
+            self.processor = EmailProcessor()
     
     def test_process_emails_with_mock_schedule(self):
         """Test the full process_emails workflow with mocked schedule."""
         # Setup mocks
-        mock_message = {
-            'from': 'test@matrixcare.com',
-            'subject': 'MatrixCare Automation for Looker Dash',
-            'body': 'Test email content for Looker Dashboard'
-        }
+        fixtures = _build_fixture_mocks()
+        row = ['2025-09-29', '2025-09-29', 'Orchard Community', 'Hot Lead', '1', 'Website', 'Google Ads', '12345']
         
-        # Mock the Gmail service to return a message
+        # Mock the Gmail service to return a message carrying a CSV export of one lead
         self.processor.gmail_service.search_emails = Mock(return_value=['msg123'])
-        self.processor.gmail_service.get_message_with_attachments = Mock(return_value=mock_message)
+        self.processor.gmail_service.get_messages_with_attachments_batch = Mock(return_value=[{
+            **fixtures.message,
+            'id': 'msg123',
+            'attachments': [{'filename': 'leads.csv', 'mimeType': 'text/csv', 'data': 'bGVhZHM='}]
+        }])
+        self.processor.csv_processor.process_csv_attachment = Mock(return_value=[dict(zip(_SHEET_HEADERS, row))])
+        self.processor.csv_processor.prepare_sheets_data = Mock(return_value=(_SHEET_HEADERS, [row]))
         
         # Mock the Sheets service
-        self.processor.sheets_service.append_data_to_sheet = Mock(return_value=True)
+        self.processor.sheets_service.append_data_without_duplicates = Mock(return_value=True)
         
         # Set target spreadsheet ID
         self.processor.target_spreadsheet_id = 'test_spreadsheet_id'
         
         # Mock the time to be the correct Tuesday at 11:20 AM
-        target_tuesday = date(2025, 9, 30)
-        target_time = datetime(2025, 9, 30, 11, 20, 0)
+        target_time = fixtures.target_time
         
-        with patch('email_processor.datetime') as mock_datetime:
-            mock_now = Mock()
-            mock_now.date.return_value = target_tuesday
-            mock_now.time.return_value = target_time.time()
-            mock_now.strftime.return_value = '2025-09-30 11:20:00'
-            mock_datetime.now.return_value = mock_now
-            
+        with _freeze(target_time.date(), target_time.time()):
             # Run the process
             self.processor.process_emails()
             
-            # Verify that Gmail was searched
+            # Verify that Gmail was searched for emails since midnight
             self.processor.gmail_service.search_emails.assert_called_once()
+            self.assertEqual(self.processor.gmail_service.search_emails.call_args[1]['since_minutes'], 11 * 60 + 20)
             
-            # Verify that the message was retrieved
-            self.processor.gmail_service.get_message_with_attachments.assert_called_once_with('msg123')
-            
-            # Verify that data was appended to the sheet
-            self.processor.sheets_service.append_data_to_sheet.assert_called_once()
-            
-            # Check the call arguments to sheets service
-            call_args = self.processor.sheets_service.append_data_to_sheet.call_args
-            self.assertEqual(call_args[1]['spreadsheet_id'], 'test_spreadsheet_id')
-            self.assertEqual(call_args[1]['sheet_name'], 'Sheet1')
+            # Verify that all messages were retrieved in one batch
+            self.processor.gmail_service.get_messages_with_attachments_batch.assert_called_once_with(['msg123'])
             
-            # Check that data contains expected values
-            data = call_args[1]['data'][0]  # First row of data
-            self.assertEqual(data[1], 'test@matrixcare.com')  # From email
-            self.assertEqual(data[2], 'MatrixCare Automation for Looker Dash')  # Subject
-            self.assertEqual(data[3], 'Test email content for Looker Dashboard')  # Content
-            self.assertEqual(data[4], 'Processed')  # Status
+            # Verify that the CSV rows were appended to the sheet, skipping duplicate lead IDs
+            self.processor.sheets_service.append_data_without_duplicates.assert_called_once_with(
+                spreadsheet_id='test_spreadsheet_id',
+                data=[row],
+                sheet_name='Sheet1',
+                unique_columns=[7]
+            )
 
 
-class TestMatrixCareIntegration(unittest.TestCase):
-    """Integration test that simulates the actual workflow."""
+@pytest.fixture(scope='class')
+def frozen_time():
+    """Freeze the current time at the target Tuesday at 11:20 AM for the whole class."""
+    target_time = _build_fixture_mocks().target_time
+    with _freeze(target_time.date(), target_time.time()):
+        yield target_time
+
+
+@pytest.fixture(scope='class')
+def processor(mock_gmail_stack, frozen_time):
+    """One EmailProcessor, with mocked services, built once and shared across checks."""
+    # Setup service mocks (environment and service classes come from the fixture)
+    mock_gmail = mock_gmail_stack.gmail.return_value
+    mock_sheets = mock_gmail_stack.sheets.return_value
     
-    def test_full_workflow_simulation(self):
-        """Test the complete workflow by simulating it's the right time."""
-        print("\n" + "="*60)
-        print("INTEGRATION TEST: MatrixCare Looker Dashboard Automation")
-        print("="*60)
-        
-        # Mock environment variables for the test
-        test_env = {
-            'GMAIL_CREDENTIALS_FILE': 'credentials.json',
-            'GMAIL_TOKEN_FILE': 'token.json',
-            'GMAIL_FROM_EMAIL': 'growatorchard@gmail.com',
-            'GMAIL_SUBJECT_FILTER': 'MatrixCare Automation for Looker Dash',
-            'GOOGLE_DRIVE_FOLDER_ID': '1xrzn2LZ-URdb1nx_7MspHyytq6LVk1iq',
-            'GOOGLE_SHEETS_SPREADSHEET_ID': 'your_actual_spreadsheet_id_here',
-            'LOG_LEVEL': 'INFO'
-        }
-        
-        with patch.dict(os.environ, test_env):
-            # Mock services to avoid actual API calls
-            with patch('email_processor.GmailService') as MockGmail, \
-                 patch('email_processor.GoogleDriveService') as MockDrive, \
-                 patch('email_processor.GoogleSheetsService') as MockSheets, \
-                 patch('email_processor.CSVProcessor') as MockCSV:
-                
-                # Setup service mocks
-                mock_gmail = MockGmail.return_value
-                mock_sheets = MockSheets.return_value
-                
-                # Mock email search results
-                mock_gmail.search_emails.return_value = ['test_message_123']
-                
-                # Mock email message
-                mock_message = {
-                    'from': 'automation@matrixcare.com',
-                    'subject': 'MatrixCare Automation for Looker Dash',
-                    'body': 'Dashboard data for October 8, 2025\n\nKey metrics:\n- Total patients: 1,234\n- Active cases: 567\n- Completed assessments: 890'
-                }
-                mock_gmail.get_message_with_attachments.return_value = mock_message
-                
-                # Mock successful sheet append
-                mock_sheets.append_data_to_sheet.return_value = True
-                
-                # Create processor
-                processor = EmailProcessor()
-                processor.target_spreadsheet_id = 'test_spreadsheet_id'
-                
-                # Mock the current time to be Tuesday, October 8, 2025 at 11:20 AM
-                target_time = datetime(2025, 9, 30, 11, 20, 0)
-                
-                with patch('email_processor.datetime') as mock_dt:
-                    mock_now = Mock()
-                    mock_now.date.return_value = target_time.date()
-                    mock_now.time.return_value = target_time.time()
-                    mock_now.strftime.return_value = '2025-09-30 11:20:00'
-                    mock_dt.now.return_value = mock_now
-                    
-                    print(f"🕐 Simulated time: {target_time}")
-                    print(f"📅 Is target Tuesday: {processor.is_target_tuesday()}")
-                    print(f"✅ Should check emails: {processor.should_check_emails()}")
-                    
-                    # Run the email processing
-                    print("\n🔄 Running email processing...")
-                    processor.process_emails()
-                    
-                    # Verify the workflow
-                    print("\n📋 Verification Results:")
-                    print(f"   Gmail search called: {mock_gmail.search_emails.called}")
-                    print(f"   Message retrieved: {mock_gmail.get_message_with_attachments.called}")
-                    print(f"   Sheet append called: {mock_sheets.append_data_to_sheet.called}")
-                    
-                    if mock_sheets.append_data_to_sheet.called:
-                        call_args = mock_sheets.append_data_to_sheet.call_args
-                        data_row = call_args[1]['data'][0]
-                        print(f"   Data appended: {data_row}")
-                    
-                    print("\n✅ Test completed successfully!")
+    # Mock email search results; each test supplies the message and its rows
+    mock_gmail.search_emails.return_value = ['test_message_123']
+    
+    # Mock successful sheet append
+    mock_sheets.append_data_without_duplicates.return_value = True
+    
+    # Create processor
+    processor = EmailProcessor()
+    processor.target_spreadsheet_id = 'test_spreadsheet_id'
+    return processor
 
 
-if __name__ == '__main__':
-    # Run the tests
-    unittest.main(verbosity=2)
+@pytest.mark.parametrize('subject,expected_row', [
+    ('MatrixCare Automation for Looker Dash',
+     ['2025-09-29', '2025-09-29', 'Orchard Community', 'Hot Lead', '1', 'Website', 'Google Ads', '12345']),
+    ('Fwd: MatrixCare Automation for Looker Dash',
+     ['2025-09-28', '2025-09-28', 'Maple Grove', 'Warm Lead', '2', 'Referral', 'Agent', '12346']),
+    ('MatrixCare Automation for Looker Dash - Weekly Export',
+     ['2025-09-27', '2025-09-27', 'Cedar Point', 'Cold Lead', '1', 'Phone', 'Referral', '12347']),
+])
+def test_matrixcare_integration(processor, caplog, subject, expected_row):
+    """Test the complete workflow at the scheduled time for each MatrixCare subject line."""
+    mock_gmail = processor.gmail_service
+    mock_sheets = processor.sheets_service
+    mock_csv = processor.csv_processor
+    for mock_service in (mock_gmail, mock_sheets, mock_csv):
+        mock_service.reset_mock()
+    
+    # A message with this subject carrying a CSV export of one lead
+    mock_gmail.get_messages_with_attachments_batch.return_value = [{
+        **_build_fixture_mocks().message,
+        'id': 'test_message_123',
+        'subject': subject,
+        'attachments': [{'filename': 'leads.csv', 'mimeType': 'text/csv', 'data': 'bGVhZHM='}]
+    }]
+    mock_csv.process_csv_attachment.return_value = [dict(zip(_SHEET_HEADERS, expected_row))]
+    mock_csv.prepare_sheets_data.return_value = (_SHEET_HEADERS, [expected_row])
+    
+    # Run the email processing
+    with caplog.at_level(logging.INFO, logger='email_processor'):
+        processor.process_emails()
+    
+    # Verify the workflow
+    mock_gmail.search_emails.assert_called_once()
+    mock_gmail.get_messages_with_attachments_batch.assert_called_once_with(['test_message_123'])
+    mock_sheets.append_data_without_duplicates.assert_called_once_with(
+        spreadsheet_id='test_spreadsheet_id',
+        data=[expected_row],
+        sheet_name='Sheet1',
+        unique_columns=[7]
+    )
+    assert f"Subject: {subject}" in caplog.text
+    assert "Successfully appended 1 rows to existing spreadsheet" in caplog.text
@@ -6,8 +6,15 @@ Test script for Google Sheets functionality.
 import os
 import sys
 import logging
+from datetime import date, timedelta
+from itertools import cycle, islice, product
+from uuid import uuid4
+from unittest.mock import MagicMock, patch
+import httplib2
+import pytest
 from dotenv import load_dotenv
-from google_sheets_service import GoogleSheetsService
+from googleapiclient.errors import HttpError
+from google_sheets_service import GoogleSheetsService, TokenBucket, MAX_CELLS, MAX_RETRY_AFTER, REQUESTS_PER_MINUTE, LEAD_HEADERS, HEADER_FORMAT_REQUESTS
 
 # Load environment variables
 load_dotenv()
@@ -18,65 +25,258 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
-def test_sheets_service():
+# Test data, built once as the full 2D payload sent to the API
+HEADERS = ['LeadCreationDate', 'InquiryDate', 'CommunityName', 'Classification', 'TotalLeads', 'SubSourceName', 'SourceName']
+TEST_DATA = [
+    ['2024-01-15', '2024-01-15', 'Sample Community', 'Hot Lead', '1', 'Website', 'Google Ads'],
+    ['2024-01-16', '2024-01-16', 'Another Community', 'Warm Lead', '1', 'Email', 'Facebook'],
+    ['2024-01-17', '2024-01-17', 'Test Community', 'Cold Lead', '1', 'Phone', 'Referral']
+]
+
+# Column values combined by make_rows for large synthetic data sets
+_DATES = [(date(2024, 1, 1) + timedelta(days=day)).isoformat() for day in range(366)]
+_COMMUNITIES = ('Sample Community', 'Another Community', 'Test Community')
+_CLASSIFICATIONS = ('Hot Lead', 'Warm Lead', 'Cold Lead')
+_SOURCES = (('Website', 'Google Ads'), ('Email', 'Facebook'), ('Phone', 'Referral'))
+
+def make_rows(n):
+    """Build n synthetic lead rows shaped like TEST_DATA."""
+    # product/cycle/islice generate the combinations in C; one comprehension builds the rows
+    combinations = islice(cycle(product(_DATES, _COMMUNITIES, _CLASSIFICATIONS, _SOURCES)), n)
+    return [
+        [day, day, community, classification, '1', sub_source, source]
+        for day, community, classification, (sub_source, source) in combinations
+    ]
+
+def test_append_single_request(local_sheets_service):
+    """Test that appending rows sends one values.append request."""
+    append = local_sheets_service.service.spreadsheets.return_value.values.return_value.append
+    
+    assert local_sheets_service.append_data_to_sheet('sheet123', TEST_DATA)
+    
+    assert append.call_count == 1
+    assert append.call_args[1]['body'] == {'values': TEST_DATA}
+
+def test_append_large_chunked_by_cells(local_sheets_service):
+    """Test that a large append is split so no request exceeds MAX_CELLS."""
+    append = local_sheets_service.service.spreadsheets.return_value.values.return_value.append
+    rows = make_rows(10000)
+    
+    assert local_sheets_service.append_data_to_sheet('sheet123', rows)
+    
+    chunks = [call[1]['body']['values'] for call in append.call_args_list]
+    assert [len(chunk) for chunk in chunks] == [MAX_CELLS // len(HEADERS), 10000 - MAX_CELLS // len(HEADERS)]
+    assert all(len(chunk) * len(HEADERS) <= MAX_CELLS for chunk in chunks)
+    assert [row for chunk in chunks for row in chunk] == rows
+
+def test_append_partial_failure_logs_rows_written(local_sheets_service, caplog):
+    """Test that a failed later chunk reports how many rows the earlier chunks wrote."""
+    append = local_sheets_service.service.spreadsheets.return_value.values.return_value.append
+    append.return_value.execute.side_effect = [{}, HttpError(httplib2.Response({'status': 400}), b'Bad request')]
+    rows = make_rows(10000)
+    
+    assert not local_sheets_service.append_data_to_sheet('sheet123', rows)
+    
+    assert f"after writing {MAX_CELLS // len(HEADERS)} of 10000 rows" in caplog.text
+
+def test_batch_get_single_request(local_sheets_service):
+    """Test that reading several ranges sends one values.batchGet request."""
+    batch_get = local_sheets_service.service.spreadsheets.return_value.values.return_value.batchGet
+    value_ranges = [{'range': 'Sheet1!A1:G1', 'values': [HEADERS]}, {'range': 'Sheet1!A2:G4', 'values': TEST_DATA}]
+    batch_get.return_value.execute.return_value = {'valueRanges': value_ranges}
+    
+    result = local_sheets_service.batch_get('sheet123', ['Sheet1!A1:G1', 'Sheet1!A2:G4'])
+    
+    assert result == value_ranges
+    batch_get.assert_called_once_with(spreadsheetId='sheet123', ranges=['Sheet1!A1:G1', 'Sheet1!A2:G4'])
+
+def test_get_values_unformatted(local_sheets_service):
+    """Test that get_values asks for unformatted values and serial-number dates by default."""
+    get = local_sheets_service.service.spreadsheets.return_value.values.return_value.get
+    get.return_value.execute.return_value = {'values': TEST_DATA[-1:]}
+    
+    assert local_sheets_service.get_values('sheet123', 'Sheet1!A4:G4') == TEST_DATA[-1:]
+    get.assert_called_once_with(spreadsheetId='sheet123', range='Sheet1!A4:G4',
+                                valueRenderOption='UNFORMATTED_VALUE', dateTimeRenderOption='SERIAL_NUMBER')
+
+class _FakeClock:
+    """Stands in for the time module so retry waits pass instantly but are still measured."""
+    
+    def __init__(self):
+        self.now = 0.0
+    
+    def monotonic(self):
+        return self.now
+    
+    def sleep(self, seconds):
+        self.now += seconds
+
+def _rate_limit_error(**headers):
+    """A 429 HttpError with the given response headers."""
+    return HttpError(httplib2.Response({'status': 429, **headers}), b'Rate limit')
+
+@patch('google_sheets_service.time', new_callable=_FakeClock)
+def test_execute_throttles_on_rate_limit(clock, local_sheets_service):
+    """Test that a 429 response waits for Retry-After, halves the bucket's rate and retries."""
+    bucket = local_sheets_service._bucket
+    request = MagicMock()
+    request.execute.side_effect = [_rate_limit_error(**{'retry-after': '7'}), {'ok': True}]
+    
+    assert local_sheets_service._execute(request) == {'ok': True}
+    
+    assert request.execute.call_count == 2
+    assert clock.now >= 7
+    assert bucket.rate == bucket.base_rate / 2
+
+@patch('google_sheets_service.time', new_callable=_FakeClock)
+def test_execute_backs_off_on_persistent_rate_limit(clock, local_sheets_service):
+    """Test that retries against a permanent 429 are spread out with exponential backoff."""
+    # Same settings as the shared class bucket, built under the fake clock
+    bucket = TokenBucket(rate=REQUESTS_PER_MINUTE / 60.0, capacity=REQUESTS_PER_MINUTE)
+    local_sheets_service._bucket = bucket
+    request = MagicMock()
+    request.execute.side_effect = _rate_limit_error()
+    
+    with pytest.raises(HttpError):
+        local_sheets_service._execute(request)
+    
+    assert request.execute.call_count == 6
+    assert clock.now >= 1 + 2 + 4 + 8 + 16
+    # Halved once for the whole burst, not once per 429
+    assert bucket.rate == bucket.base_rate / 2
+
+@patch('google_sheets_service.time', new_callable=_FakeClock)
+def test_execute_caps_retry_after(clock, local_sheets_service):
+    """Test that an oversized Retry-After is capped instead of stalling the run."""
+    local_sheets_service._bucket = TokenBucket(rate=REQUESTS_PER_MINUTE / 60.0, capacity=REQUESTS_PER_MINUTE)
+    request = MagicMock()
+    request.execute.side_effect = [_rate_limit_error(**{'retry-after': '3600'}), {'ok': True}]
+    
+    assert local_sheets_service._execute(request) == {'ok': True}
+    
+    # The throttled bucket adds a few seconds on top of the capped wait
+    assert MAX_RETRY_AFTER <= clock.now < 2 * MAX_RETRY_AFTER
+
+@patch('google_sheets_service.time', new_callable=_FakeClock)
+def test_append_not_retried_on_server_error(clock, local_sheets_service):
+    """Test that a 5xx on a non-idempotent request is raised, not retried, so rows aren't written twice."""
+    request = MagicMock()
+    request.execute.side_effect = HttpError(httplib2.Response({'status': 503}), b'Backend error')
+    
+    with pytest.raises(HttpError):
+        local_sheets_service._execute(request, idempotent=False)
+    
+    assert request.execute.call_count == 1
+
+def test_create_and_populate_batched(local_sheets_service):
+    """Test that creating a sheet writes all rows and formatting in one request each."""
+    local_sheets_service.create_spreadsheet = MagicMock(return_value={'id': 'sheet123'})
+    spreadsheets = local_sheets_service.service.spreadsheets.return_value
+    
+    assert local_sheets_service.create_and_populate_spreadsheet('Test', HEADERS, TEST_DATA)
+    
+    values_update = spreadsheets.values.return_value.batchUpdate
+    assert values_update.call_count == 1
+    assert values_update.call_args[1]['body']['data'][0]['values'] == [HEADERS] + TEST_DATA
+    assert spreadsheets.batchUpdate.call_count == 1
+    assert len(spreadsheets.batchUpdate.call_args[1]['body']['requests']) == 2
+
+def test_create_and_populate_reuses_header_requests(local_sheets_service):
+    """Test that lead data sheets are formatted with the prebuilt header requests."""
+    local_sheets_service.create_spreadsheet = MagicMock(return_value={'id': 'sheet123'})
+    spreadsheets = local_sheets_service.service.spreadsheets.return_value
+    
+    assert local_sheets_service.create_and_populate_spreadsheet('Test', list(LEAD_HEADERS), [])
+    
+    requests = spreadsheets.batchUpdate.call_args[1]['body']['requests']
+    assert requests == list(HEADER_FORMAT_REQUESTS)
+    assert requests[0]['repeatCell']['range']['endColumnIndex'] == len(LEAD_HEADERS)
+    assert all(request is not shared for request, shared in zip(requests, HEADER_FORMAT_REQUESTS))
+
+def test_create_and_populate_other_eight_columns(local_sheets_service):
+    """Test that an 8-column sheet that isn't lead data gets its own header requests."""
+    local_sheets_service.create_spreadsheet = MagicMock(return_value={'id': 'sheet123'})
+    spreadsheets = local_sheets_service.service.spreadsheets.return_value
+    headers = [f'Column{i}' for i in range(len(LEAD_HEADERS))]
+    
+    with patch.object(GoogleSheetsService, '_header_format_request', wraps=GoogleSheetsService._header_format_request) as mock_header:
+        assert local_sheets_service.create_and_populate_spreadsheet('Test', headers, [])
+    
+    mock_header.assert_called_once_with(num_columns=len(headers))
+
+@patch('google_sheets_service.gspread.authorize')
+@patch('google_sheets_service.build')
+@patch('google_sheets_service.get_creds', return_value=MagicMock(valid=True))
+def test_sheets_local(mock_get_creds, mock_build, mock_authorize):
+    """Test the create-and-populate path against a fake discovery service."""
+    spreadsheets = mock_build.return_value.spreadsheets.return_value
+    spreadsheets.create.return_value.execute.return_value = {'spreadsheetId': 'X', 'spreadsheetUrl': 'Y'}
+    
+    sheets_service = GoogleSheetsService('credentials.json')
+    sheet_info = sheets_service.create_and_populate_spreadsheet(
+        title="Test Lead Data - Google Sheets Integration",
+        headers=HEADERS,
+        data=TEST_DATA
+    )
+    
+    assert sheet_info['id'] == 'X'
+    assert sheet_info['url'] == 'https://docs.google.com/spreadsheets/d/X/edit'
+    mock_build.assert_called_once_with('sheets', 'v4', credentials=mock_get_creds.return_value, http=None)
+    assert spreadsheets.values.return_value.batchUpdate.call_args[1]['body']['data'][0]['values'] == [HEADERS] + TEST_DATA
+
+@pytest.mark.remote_data
+@pytest.mark.xdist_group('google_api')
+def test_sheets_service(sheets_service):
     """Test Google Sheets service functionality."""
     
     print("🧪 Testing Google Sheets Service")
     print("================================")
     
-    try:
-        # Initialize service
-        credentials_file = os.getenv('GOOGLE_SHEETS_CREDENTIALS_FILE', 'credentials.json')
-        folder_id = os.getenv('GOOGLE_DRIVE_FOLDER_ID')
-        
-        if folder_id in ['/', '', None]:
-            folder_id = None
-        
-        print(f"📁 Using folder ID: {folder_id or 'Root folder'}")
-        
-        sheets_service = GoogleSheetsService(credentials_file)
-        print("✅ Google Sheets service authenticated successfully")
-        
-        # Test data
-        headers = ['LeadCreationDate', 'InquiryDate', 'CommunityName', 'Classification', 'TotalLeads', 'SubSourceName', 'SourceName']
-        test_data = [
-            ['2024-01-15', '2024-01-15', 'Sample Community', 'Hot Lead', '1', 'Website', 'Google Ads'],
-            ['2024-01-16', '2024-01-16', 'Another Community', 'Warm Lead', '1', 'Email', 'Facebook'],
-            ['2024-01-17', '2024-01-17', 'Test Community', 'Cold Lead', '1', 'Phone', 'Referral']
-        ]
-        
-        print(f"📊 Test data: {len(test_data)} rows with {len(headers)} columns")
-        
-        # Create and populate spreadsheet
-        title = "Test Lead Data - Google Sheets Integration"
-        
-        print(f"📝 Creating spreadsheet: {title}")
-        sheet_info = sheets_service.create_and_populate_spreadsheet(
-            title=title,
-            headers=headers,
-            data=test_data,
-            folder_id=folder_id
-        )
-        
-        if sheet_info:
-            print("✅ Test completed successfully!")
-            print(f"📋 Sheet Title: {sheet_info['title']}")
-            print(f"🆔 Sheet ID: {sheet_info['id']}")
-            print(f"🔗 Sheet URL: {sheet_info['url']}")
-            print("")
-            print("🎉 You can now view your test spreadsheet in Google Drive!")
-            print("   The sheet should have:")
-            print("   - Formatted header row (blue background, white text, bold)")
-            print("   - Auto-resized columns")
-            print("   - 3 rows of test lead data")
-            return True
-        else:
-            print("❌ Failed to create test spreadsheet")
-            return False
-            
-    except Exception as e:
-        print(f"❌ Error during testing: {e}")
-        return False
+    folder_id = os.getenv('GOOGLE_DRIVE_FOLDER_ID')
+    
+    if folder_id in ['/', '', None]:
+        folder_id = None
+    
+    print(f"📁 Using folder ID: {folder_id or 'Root folder'}")
+    
+    print(f"📊 Test data: {len(TEST_DATA)} rows with {len(HEADERS)} columns")
+    
+    # Create and populate spreadsheet
+    # Unique per run so parallel workers never share a spreadsheet
+    title = f"Test Lead Data - Google Sheets Integration {uuid4()}"
+    
+    print(f"📝 Creating spreadsheet: {title}")
+    sheet_info = sheets_service.create_and_populate_spreadsheet(
+        title=title,
+        headers=HEADERS,
+        data=TEST_DATA,
+        folder_id=folder_id
+    )
+    assert sheet_info, "Failed to create test spreadsheet"
+    
+    # Read the header and data ranges back in one request
+    value_ranges = sheets_service.batch_get(
+        sheet_info['id'],
+        ['Sheet1!A1:G1', f'Sheet1!A2:G{len(TEST_DATA) + 1}']
+    )
+    assert [value_range.get('values', []) for value_range in value_ranges] == [[HEADERS], TEST_DATA], \
+        "Spreadsheet contents don't match the test data"
+    
+    # RAW writes are stored as text, so the unformatted last row matches exactly
+    last_row = len(TEST_DATA) + 1
+    assert sheets_service.get_values(sheet_info['id'], f'Sheet1!A{last_row}:G{last_row}') == TEST_DATA[-1:], \
+        "Last row doesn't match the test data"
+    
+    print("✅ Test completed successfully!")
+    print(f"📋 Sheet Title: {sheet_info['title']}")
+    print(f"🆔 Sheet ID: {sheet_info['id']}")
+    print(f"🔗 Sheet URL: {sheet_info['url']}")
+    print("")
+    print("🎉 You can now view your test spreadsheet in Google Drive!")
+    print("   The sheet should have:")
+    print("   - Formatted header row (blue background, white text, bold)")
+    print("   - Auto-resized columns")
+    print("   - 3 rows of test lead data")
 
 def main():
     """Main test function."""
@@ -88,13 +288,21 @@ def main():
         print("Please ensure your Google API credentials are in place.")
         sys.exit(1)
     
-    success = test_sheets_service()
+    try:
+        sheets_service = GoogleSheetsService(credentials_file)
+        print("✅ Google Sheets service authenticated successfully")
+    except Exception as e:
+        print(f"❌ Error during authentication: {e}")
+        sys.exit(1)
     
-    if success:
-        print("\n🎊 All tests passed! Google Sheets integration is working correctly.")
-    else:
+    try:
+        test_sheets_service(sheets_service)
+    except Exception as e:
+        print(f"❌ Error during testing: {e}")
         print("\n💥 Tests failed. Please check the error messages above.")
         sys.exit(1)
+    
+    print("\n🎊 All tests passed! Google Sheets integration is working correctly.")
 
 if __name__ == '__main__':
     main()